@@ -0,0 +1,143 @@
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+from storage import ShardedJsonStorage
+
+
+# Dates recognised in form names: 2024-06-14, 14/06/2024, 14.6.24
+ISO_DATE = re.compile(r'(\d{4})-(\d{1,2})-(\d{1,2})')
+DAY_FIRST_DATE = re.compile(r'(\d{1,2})[./](\d{1,2})[./](\d{2}|\d{4})(?!\d)')
+
+
+def form_date(form_name):
+    """The bake day in a form's name, or None.
+
+    Forms without a date in their name are never archived by age (only when
+    listed by name): an order timestamp says when customers ordered, not
+    whether the bake is over.
+    """
+    try:
+        match = ISO_DATE.search(form_name)
+        if match:
+            return date(int(match[1]), int(match[2]), int(match[3]))
+        match = DAY_FIRST_DATE.search(form_name)
+        if match:
+            year = int(match[3])
+            return date(year + 2000 if year < 100 else year, int(match[2]), int(match[1]))
+    except ValueError:
+        pass
+    return None
+
+
+class ColdStore:
+    """Compressed archive of past forms, one gzip file per form.
+
+    Each file holds the form's forms entry and orders entry. ``index.json``
+    lists the archived forms with their order ids, so lookups by form or by
+    order id only open the one file they need. Loaded forms are kept in a
+    small LRU cache; archived forms are read-only.
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, directory, cache_size=16):
+        self.directory = directory
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self._index = {}
+        self._order_forms = {}
+        self._index_signature = None
+        self._cache = OrderedDict()
+
+    def _index_path(self):
+        return os.path.join(self.directory, self.INDEX)
+
+    def _write(self, filename, body):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=filename + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, os.path.join(self.directory, filename))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def index(self):
+        """name -> {"file", "archived_at", "date", "order_ids"}, re-read when the file changes"""
+        with self.lock:
+            try:
+                st = os.stat(self._index_path())
+                signature = (st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                signature = None
+            if signature != self._index_signature:
+                if signature is None:
+                    self._index = {}
+                else:
+                    with open(self._index_path()) as f:
+                        self._index = json.load(f)
+                self._order_forms = {order_id: name for name, entry in self._index.items()
+                                     for order_id in entry["order_ids"]}
+                self._index_signature = signature
+            return self._index
+
+    def __contains__(self, form_name):
+        return form_name in self.index()
+
+    def save(self, form_name, form, form_orders, bake_date=None):
+        """Archive one form; the caller removes it from the hot data afterwards.
+
+        Archived forms are never overwritten: that would lose their orders.
+        """
+        if form_name in self.index():
+            raise ValueError(f"Form '{form_name}' is already archived")
+        filename = ShardedJsonStorage.shard_filename(form_name) + '.gz'
+        payload = {"name": form_name, "form": form, "orders": form_orders}
+        self._write(filename, gzip.compress(json.dumps(payload).encode('utf-8')))
+        index = dict(self.index())
+        index[form_name] = {
+            "file": filename,
+            "archived_at": datetime.now().isoformat(),
+            "date": bake_date.isoformat() if bake_date else None,
+            "order_ids": [order["id"] for order in form_orders.get("orders", [])],
+        }
+        self._write(self.INDEX, json.dumps(index, indent=2).encode('utf-8'))
+        with self.lock:
+            self._cache.pop(form_name, None)
+
+    def load(self, form_name):
+        """{"name", "form", "orders"} of an archived form, or None"""
+        entry = self.index().get(form_name)
+        if entry is None:
+            return None
+        with self.lock:
+            if form_name in self._cache:
+                self._cache.move_to_end(form_name)
+                return self._cache[form_name]
+        with gzip.open(os.path.join(self.directory, entry["file"]), 'rb') as f:
+            payload = json.load(f)
+        with self.lock:
+            self._cache[form_name] = payload
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return payload
+
+    def find_order(self, order_id):
+        """(form name, order) of an archived order, or (None, None)"""
+        self.index()
+        form_name = self._order_forms.get(order_id)
+        if form_name is None:
+            return None, None
+        for order in self.load(form_name)["orders"]["orders"]:
+            if order["id"] == order_id:
+                return form_name, order
+        return None, None
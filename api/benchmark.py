@@ -0,0 +1,388 @@
+"""Benchmark the order API under a form-opening rush.
+
+Seeds synthetic forms/orders, then replays a mix of storefront polling,
+order bursts and order edits, and reports throughput, p50/p95/p99 per
+operation and the bytes written to storage.
+
+    python benchmark.py run --requests 5000 --threads 8 --save before.json
+    python benchmark.py run --requests 5000 --threads 8 --compare before.json
+
+By default the real routes run in-process through the Flask test client,
+in a temporary directory (STORAGE_BACKEND / ORDERS_JOURNAL apply as usual).
+To measure a running server instead, seed its data directory first:
+
+    python benchmark.py seed --dir /srv/bench
+    (start the API with /srv/bench as working directory)
+    python benchmark.py run --url http://127.0.0.1:5000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from store import add_order_to_aggregates
+
+
+# Share of each operation in the mix (a rush: mostly polling and new orders)
+OPERATION_MIX = {
+    "get_products": 0.45,
+    "storefront": 0.10,
+    "create_order": 0.25,
+    "update_order": 0.10,
+    "remove_order": 0.05,
+    "move_order": 0.05,
+}
+
+
+def build_dataset(forms=20, products=15, orders=200, extras=3, inventory=1000000, seed=1):
+    """Return synthetic (forms_data, orders) documents in the app's format"""
+    rng = random.Random(seed)
+    catalog = [{
+        "name": f"Bread {j}",
+        "description": "Synthetic benchmark product",
+        "extras": [{"name": f"extra {k}", "minAmount": 0, "maxAmount": 5, "price": 10 + k}
+                   for k in range(extras)],
+        "soldOut": False,
+        "existent": True,
+        "inventory": inventory,
+        "flour": 500, "water": 350, "salt": 10,
+        "flours": [{"name": "white", "percentage": 100}],
+        "sourdough_white": 100,
+    } for j in range(products)]
+
+    forms_data = {"generic_products": {"products": catalog}}
+    orders_data = {}
+    stamp = 1700000000.0
+    for i in range(forms):
+        form_name = f"bench-{i:03d}"
+        forms_data[form_name] = {
+            "products": [dict(p) for p in catalog],
+            "metadata": {"visible": True},
+            "comment": "",
+        }
+        form_orders = {"orders": [], "products": {}}
+        for n in range(orders):
+            stamp += 0.001
+            chosen = rng.sample(catalog, rng.randint(1, min(3, products)))
+            order = {
+                "id": str(stamp),
+                "name": f"Customer {n}",
+                "phone": f"05{rng.randint(0, 99999999):08d}",
+                "date": form_name,
+                "comment": "",
+                "selectedProducts": {
+                    p["name"]: {"selected": True,
+                                "extras": {e["name"]: rng.randint(0, 2) for e in p["extras"]}}
+                    for p in chosen
+                },
+                "totalAmount": 0,
+                "timestamp": "2024-01-01T00:00:00",
+            }
+            form_orders["orders"].append(order)
+            add_order_to_aggregates(form_orders["products"], order)
+        orders_data[form_name] = form_orders
+    return forms_data, orders_data
+
+
+def seed_directory(directory, **scale):
+    os.makedirs(directory, exist_ok=True)
+    forms_data, orders_data = build_dataset(**scale)
+    with open(os.path.join(directory, 'forms.json'), 'w') as f:
+        json.dump(forms_data, f, indent=2)
+    with open(os.path.join(directory, 'orders.json'), 'w') as f:
+        json.dump(orders_data, f, indent=2)
+
+
+class InProcessClient:
+    """Drives index.app through Flask test clients (one per thread)"""
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+
+    def request(self, method, path, body=None):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body)
+        return response.status_code, response.get_data()
+
+
+class HttpClient:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def bytes_written(client):
+    """Total bytes written to storage per document, from /api/metrics"""
+    status, body = client.request('GET', '/api/metrics')
+    totals = {}
+    if status != 200:
+        return totals
+    for line in body.decode('utf-8').splitlines():
+        if line.startswith('bakery_storage_write_bytes_sum{'):
+            labels, value = line.rsplit(' ', 1)
+            document = labels.split('document="', 1)[1].split('"', 1)[0]
+            totals[document] = float(value)
+    return totals
+
+
+class Workload:
+    """Shared state of one run: known forms, products and live order ids"""
+
+    def __init__(self, client, seed):
+        self.client = client
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        status, body = client.request('GET', '/api/dates')
+        self.forms = [f for f in json.loads(body)["dates"]]
+        if not self.forms:
+            raise SystemExit("No forms to benchmark against; seed the data first")
+        status, body = client.request('GET', '/api/orders')
+        orders = json.loads(body)["orders"]
+        self.order_ids = [o["id"] for form in orders.values() for o in form["orders"]]
+        status, body = client.request('GET', '/api/products/' + urllib.parse.quote(self.forms[0], safe=''))
+        self.products = [p for p in json.loads(body)["products"] if p.get("existent", True)]
+        # The form that just opened takes most of the traffic
+        self.hot_form = self.forms[0]
+
+    def _form(self):
+        return self.hot_form if self.rng.random() < 0.8 else self.rng.choice(self.forms)
+
+    def _selection(self):
+        chosen = self.rng.sample(self.products, min(len(self.products), self.rng.randint(1, 3)))
+        return {p["name"]: {"selected": True,
+                            "extras": {e["name"]: self.rng.randint(0, 2) for e in p.get("extras", [])}}
+                for p in chosen}
+
+    def next_request(self):
+        """Pick an operation from the mix; returns (name, method, path, body)"""
+        with self.lock:
+            operation = self.rng.choices(list(OPERATION_MIX), weights=list(OPERATION_MIX.values()))[0]
+            if operation in ("update_order", "remove_order", "move_order") and not self.order_ids:
+                operation = "create_order"
+            form = self._form()
+            if operation == "get_products":
+                return operation, 'GET', '/api/products/' + urllib.parse.quote(form, safe=''), None
+            if operation == "storefront":
+                return operation, 'GET', '/api/storefront', None
+            if operation == "create_order":
+                return operation, 'POST', '/api/orders', {
+                    "name": "Rush customer", "phone": "0500000000", "date": form,
+                    "comment": "", "selectedProducts": self._selection(), "totalAmount": 0}
+            if operation == "remove_order":
+                order_id = self.order_ids.pop(self.rng.randrange(len(self.order_ids)))
+                return operation, 'DELETE', f'/api/orders/{order_id}', None
+            order_id = self.rng.choice(self.order_ids)
+            if operation == "update_order":
+                return operation, 'PUT', f'/api/orders/{order_id}', {"selectedProducts": self._selection()}
+            return operation, 'POST', f'/api/orders/{order_id}/move', {"target_form": form}
+
+    def record_created(self, body):
+        try:
+            order_id = json.loads(body)["order"]["id"]
+        except (ValueError, KeyError, TypeError):
+            return
+        with self.lock:
+            self.order_ids.append(order_id)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def run_benchmark(client, requests, threads, seed):
+    workload = Workload(client, seed)
+    latencies = {name: [] for name in OPERATION_MIX}
+    errors = {name: 0 for name in OPERATION_MIX}
+    conflicts = {name: 0 for name in OPERATION_MIX}
+    record_lock = threading.Lock()
+    written_before = bytes_written(client)
+
+    def one_request(_):
+        name, method, path, body = workload.next_request()
+        started = time.perf_counter()
+        status, response_body = client.request(method, path, body)
+        elapsed = time.perf_counter() - started
+        if name == "create_order" and status == 200:
+            workload.record_created(response_body)
+        with record_lock:
+            # Only successful requests are timed: a 404 is not a fast order
+            if 200 <= status < 300 or status == 304:
+                latencies[name].append(elapsed)
+            elif status == 409:
+                # Sold out or a concurrent edit: expected in a rush
+                conflicts[name] += 1
+            else:
+                errors[name] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one_request, range(requests)))
+    duration = time.perf_counter() - started
+
+    written_after = bytes_written(client)
+    routes = {}
+    for name, values in latencies.items():
+        values.sort()
+        routes[name] = {
+            "count": len(values) + errors[name] + conflicts[name],
+            "errors": errors[name],
+            "conflicts": conflicts[name],
+            "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 3),
+            "p95_ms": round(percentile(values, 95) * 1000, 3),
+            "p99_ms": round(percentile(values, 99) * 1000, 3),
+        }
+    return {
+        "requests": requests,
+        "threads": threads,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(requests / duration, 1) if duration else 0.0,
+        "routes": routes,
+        "bytes_written": {doc: written_after.get(doc, 0) - written_before.get(doc, 0)
+                          for doc in written_after},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_report(result):
+    print(f"{result['requests']} requests, {result['threads']} threads, "
+          f"{result['duration_s']}s, {result['throughput_rps']} req/s")
+    print(f"{'operation':<14}{'count':>7}{'errors':>8}{'409s':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in result["routes"].items():
+        print(f"{name:<14}{stats['count']:>7}{stats['errors']:>8}{stats.get('conflicts', 0):>7}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    for document, written in sorted(result["bytes_written"].items()):
+        print(f"bytes written ({document}): {int(written)}")
+
+
+def compare(result, baseline, threshold):
+    """Print p95/throughput changes against a saved run; True if within threshold"""
+    ok = True
+    print(f"compared with {baseline.get('commit') or 'baseline'}:")
+    old_rps, new_rps = baseline["throughput_rps"], result["throughput_rps"]
+    if old_rps:
+        change = (new_rps - old_rps) / old_rps * 100
+        print(f"  throughput {old_rps} -> {new_rps} req/s ({change:+.1f}%)")
+        if change < -threshold:
+            ok = False
+    for name, stats in result["routes"].items():
+        old = baseline["routes"].get(name, {}).get("p95_ms")
+        if not old:
+            continue
+        change = (stats["p95_ms"] - old) / old * 100
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"  {name:<14} p95 {old} -> {stats['p95_ms']} ms ({change:+.1f}%){flag}")
+        if flag:
+            ok = False
+    return ok
+
+
+def add_scale_arguments(parser):
+    parser.add_argument('--forms', type=int, default=20)
+    parser.add_argument('--products', type=int, default=15)
+    parser.add_argument('--orders', type=int, default=200, help='orders per form')
+    parser.add_argument('--extras', type=int, default=3, help='extras per product')
+    parser.add_argument('--inventory', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    seed_parser = commands.add_parser('seed', help='write synthetic forms.json/orders.json')
+    seed_parser.add_argument('--dir', required=True)
+    add_scale_arguments(seed_parser)
+
+    run_parser = commands.add_parser('run', help='run the benchmark')
+    add_scale_arguments(run_parser)
+    run_parser.add_argument('--url', help='target a running server instead of the in-process app')
+    run_parser.add_argument('--requests', type=int, default=2000)
+    run_parser.add_argument('--threads', type=int, default=8)
+    run_parser.add_argument('--save', help='write the results as JSON')
+    run_parser.add_argument('--compare', help='JSON results of an earlier run')
+    run_parser.add_argument('--threshold', type=float, default=20.0,
+                            help='allowed p95/throughput regression in percent (exit 1 above it)')
+    args = parser.parse_args(argv)
+    # The in-process run changes directory; resolve file arguments first
+    for name in ('dir', 'save', 'compare'):
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    scale = dict(forms=args.forms, products=args.products, orders=args.orders,
+                 extras=args.extras, inventory=args.inventory, seed=args.seed)
+    if args.command == 'seed':
+        seed_directory(args.dir, **scale)
+        print(f"Seeded {args.dir}")
+        return 0
+
+    if args.url:
+        client = HttpClient(args.url)
+    else:
+        workdir = tempfile.mkdtemp(prefix='bakery-bench-')
+        seed_directory(workdir, **scale)
+        os.chdir(workdir)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import index
+        # The seed is written as forms.json/orders.json; load it into the backend
+        if index.STORAGE_BACKEND == 'sqlite':
+            from storage import migrate_json_to_sqlite
+            migrate_json_to_sqlite(index.json_storage(), index.store.storage)
+        elif index.STORAGE_BACKEND == 'sharded':
+            from storage import migrate_json_to_sharded
+            migrate_json_to_sharded(index.json_storage(), index.store.storage)
+        client = InProcessClient(index.app)
+
+    result = run_benchmark(client, args.requests, args.threads, args.seed)
+    result["commit"] = git_commit()
+    result["target"] = args.url or "in-process"
+    result["scale"] = scale
+    result["env"] = {key: os.environ.get(key, '') for key in ('STORAGE_BACKEND', 'ORDERS_JOURNAL', 'MULTI_PROCESS')}
+    print_report(result)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(result, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
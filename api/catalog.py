@@ -0,0 +1,70 @@
+# Normalized forms: a form's product entry can be a reference to a
+# generic_products entry plus the fields this form overrides, e.g.
+#
+#   {"ref": "Rye", "inventory": 20, "existent": false}
+#
+# DataStore materializes references into full products whenever the forms
+# document is loaded or written, so route handlers always see complete
+# products. Recipe fields are never overridden: they always come from the
+# catalog, so update_sourdough_amounts reaches every form.
+
+RECIPE_FIELDS = frozenset({
+    "flour", "water", "salt", "flours",
+    "sourdough_black", "sourdough_half_half", "sourdough_white",
+})
+
+
+def catalog_products(forms_data):
+    """generic_products as a name -> product dict (old list format included)"""
+    generic = forms_data.get("generic_products", [])
+    products = generic.get("products", []) if isinstance(generic, dict) else generic
+    return {p["name"]: p for p in products if isinstance(p, dict) and "name" in p}
+
+
+def _product_forms(forms_data):
+    for form_name, form in forms_data.items():
+        if form_name != "generic_products" and isinstance(form, dict) and isinstance(form.get("products"), list):
+            yield form_name, form
+
+
+def materialize_forms(forms_data):
+    """Return the forms document with every product reference resolved"""
+    catalog = catalog_products(forms_data)
+    materialized = dict(forms_data)
+    for form_name, form in _product_forms(forms_data):
+        if not any("ref" in entry for entry in form["products"]):
+            continue
+        products = []
+        for entry in form["products"]:
+            if "ref" not in entry:
+                products.append(entry)
+                continue
+            overrides = {k: v for k, v in entry.items() if k != "ref"}
+            base = catalog.get(entry["ref"], {})
+            products.append({**base, "name": entry["ref"], **overrides})
+        materialized[form_name] = {**form, "products": products}
+    return materialized
+
+
+def normalize_forms(forms_data):
+    """Return the forms document with catalog products stored as references.
+
+    Products not in the catalog, or lacking fields their catalog entry has,
+    are kept in full, so no information is lost.
+    """
+    catalog = catalog_products(forms_data)
+    normalized = dict(forms_data)
+    for form_name, form in _product_forms(forms_data):
+        entries = []
+        for product in form["products"]:
+            base = catalog.get(product.get("name")) if isinstance(product, dict) else None
+            if base is None or "ref" in product or any(
+                    k not in product for k in base if k not in RECIPE_FIELDS):
+                entries.append(product)
+                continue
+            entry = {"ref": product["name"]}
+            entry.update({k: v for k, v in product.items()
+                          if k != "name" and k not in RECIPE_FIELDS and (k not in base or base[k] != v)})
+            entries.append(entry)
+        normalized[form_name] = {**form, "products": entries}
+    return normalized
@@ -0,0 +1,35 @@
+import threading
+
+
+class StockBroadcaster:
+    """Wakes the SSE streams of a form when its stock may have changed.
+
+    Publishers bump a per-form change counter (or a global one for changes
+    that touch every form) and notify one shared Condition. An idle stream
+    costs one blocked thread and no CPU: it sleeps in ``wait()`` until its
+    form's counters move or the timeout (heartbeat) expires.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self._all = 0
+        self._forms = {}
+
+    def publish(self, form_names=None):
+        """Signal a change to the given forms, or to all of them"""
+        with self.cond:
+            if form_names is None:
+                self._all += 1
+            else:
+                for form_name in form_names:
+                    self._forms[form_name] = self._forms.get(form_name, 0) + 1
+            self.cond.notify_all()
+
+    def position(self, form_name):
+        return self._all, self._forms.get(form_name, 0)
+
+    def wait(self, form_name, seen, timeout):
+        """Block until the form changed after ``seen`` or ``timeout`` passed"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.position(form_name) != seen, timeout)
+            return self.position(form_name)
@@ -0,0 +1,191 @@
+import hashlib
+import os
+import threading
+import time
+import unicodedata
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional; without it only originals are served
+    Image = None
+
+
+# Pre-built variants: name -> longest side in pixels
+VARIANT_SIZES = {"thumb": 240, "card": 640, "full": 1600}
+VARIANT_FORMATS = {"jpg": "JPEG", "webp": "WEBP"}
+VARIANTS_DIR = 'variants'
+
+
+def normalize_image_name(name):
+    """NFC-normalize and strip a file name the way get_image compares them"""
+    return unicodedata.normalize('NFC', name).strip()
+
+
+class ImageIndex:
+    """In-memory lookup from requested image names to files in the upload folder.
+
+    Every file is indexed by its NFC-normalized name and by its case-folded
+    name, so get_image resolves "name", "name.jpg" and differently cased
+    variants with dictionary lookups instead of listing the directory.
+    The index is built once, updated by ``add()`` on upload, and re-scanned
+    when the directory's mtime changes (checked at most every
+    ``check_interval`` seconds, and on every miss).
+    """
+
+    def __init__(self, folder, check_interval=2.0):
+        self.folder = folder
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self._exact = {}
+        self._folded = {}
+        self._dir_mtime = None
+        self._checked_at = 0.0
+        self._hashes = {}
+        self.refresh(force=True)
+
+    def _dir_signature(self):
+        try:
+            return os.stat(self.folder).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, force=False):
+        """Re-scan the folder if it changed since the last scan"""
+        with self.lock:
+            self._checked_at = time.monotonic()
+            mtime = self._dir_signature()
+            if not force and mtime == self._dir_mtime:
+                return
+            exact, folded = {}, {}
+            if mtime is not None:
+                with os.scandir(self.folder) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            self._index(exact, folded, entry.name)
+            self._exact, self._folded = exact, folded
+            self._dir_mtime = mtime
+
+    @staticmethod
+    def _index(exact, folded, filename):
+        normalized = normalize_image_name(filename)
+        exact.setdefault(normalized, filename)
+        folded.setdefault(normalized.casefold(), filename)
+
+    def add(self, filename):
+        """Record a file that was just written to the folder"""
+        with self.lock:
+            exact, folded = dict(self._exact), dict(self._folded)
+            exact.pop(normalize_image_name(filename), None)
+            folded.pop(normalize_image_name(filename).casefold(), None)
+            self._index(exact, folded, filename)
+            self._exact, self._folded = exact, folded
+            self._dir_mtime = self._dir_signature()
+
+    def signature(self):
+        """Token that changes when files are added or replaced in the folder"""
+        if time.monotonic() - self._checked_at > self.check_interval:
+            self.refresh()
+        return self._dir_mtime
+
+    def content_hash(self, relpath):
+        """Short SHA-256 of a file's bytes, cached until its mtime/size change"""
+        st = os.stat(os.path.join(self.folder, relpath))
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._hashes.get(relpath)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(os.path.join(self.folder, relpath), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                digest.update(chunk)
+        value = digest.hexdigest()[:16]
+        self._hashes[relpath] = (key, value)
+        return value
+
+    def _match(self, name):
+        for candidate in (name, name + '.jpg'):
+            if candidate in self._exact:
+                return self._exact[candidate]
+        for candidate in (name, name + '.jpg'):
+            if candidate.casefold() in self._folded:
+                return self._folded[candidate.casefold()]
+        return None
+
+    def lookup(self, requested):
+        """Return the real file name for a normalized request, or None"""
+        if time.monotonic() - self._checked_at > self.check_interval:
+            self.refresh()
+        found = self._match(requested)
+        if found is None:
+            # The folder may have changed since the last check
+            self.refresh()
+            found = self._match(requested)
+        return found
+
+
+def variant_relpath(size, filename, fmt):
+    """Path of a variant relative to the upload folder, e.g. variants/thumb/x.webp"""
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(VARIANTS_DIR, size, f"{stem}.{fmt}")
+
+
+def variants_supported(fmt="jpg"):
+    if Image is None:
+        return False
+    return fmt == "jpg" or (fmt == "webp" and features.check("webp"))
+
+
+def build_variants(folder, filename, formats=("jpg", "webp"), force=False):
+    """Write every size/format variant of one original image.
+
+    Variants newer than the original are kept unless ``force`` is set.
+    Returns the relative paths that were (re)written.
+    """
+    if Image is None:
+        return []
+    source = os.path.join(folder, filename)
+    source_mtime = os.stat(source).st_mtime
+    written = []
+    with Image.open(source) as original:
+        # Apply the camera's EXIF rotation before resizing
+        original = ImageOps.exif_transpose(original).convert('RGB')
+        for size, longest in VARIANT_SIZES.items():
+            resized = None
+            for fmt in formats:
+                if not variants_supported(fmt):
+                    continue
+                relpath = variant_relpath(size, filename, fmt)
+                target = os.path.join(folder, relpath)
+                if not force and os.path.exists(target) and os.stat(target).st_mtime >= source_mtime:
+                    continue
+                if resized is None:
+                    resized = original.copy()
+                    resized.thumbnail((longest, longest), Image.LANCZOS)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp_target = target + '.tmp'
+                resized.save(tmp_target, VARIANT_FORMATS[fmt], quality=82, optimize=True)
+                os.replace(tmp_target, target)
+                written.append(relpath)
+    return written
+
+
+def find_variant(folder, filename, size, fmt):
+    """Return the relative path of an up-to-date variant, falling back to JPG.
+
+    Variants older than the original (replaced outside upload_image) are
+    skipped, so callers serve the original until build_variants runs again.
+    """
+    try:
+        source_mtime = os.stat(os.path.join(folder, filename)).st_mtime
+    except FileNotFoundError:
+        return None
+    for candidate in (fmt, "jpg"):
+        if candidate not in VARIANT_FORMATS:
+            continue
+        relpath = variant_relpath(size, filename, candidate)
+        try:
+            if os.stat(os.path.join(folder, relpath)).st_mtime >= source_mtime:
+                return relpath
+        except FileNotFoundError:
+            continue
+    return None
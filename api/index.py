@@ -1,12 +1,33 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 import json
 import os
+import base64
 import copy
-from datetime import datetime
-from flask import send_from_directory
+import csv
+import functools
+import io
+import mimetypes
+import threading
+import time
+from collections import OrderedDict
+from datetime import date as calendar_date, datetime, timezone
+from flask import Response, send_from_directory
 import urllib.parse
 
+import click
+
+import metrics
+from archive import ColdStore, form_date
+from events import StockBroadcaster
+from production import production_plan
+from profiling import RequestProfiler
+from images import (ImageIndex, VARIANT_SIZES, build_variants, find_variant,
+                    normalize_image_name)
+from store import ChangeFeed, DataStore, SharedState, StockCounters
+from storage import (JsonStorage, ShardedJsonStorage, SqliteStorage, migrate_json_to_sharded,
+                     migrate_json_to_sqlite)
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
@@ -14,7 +35,67 @@ CORS(app)  # Enable CORS for all routes
 ORDERS_FILE = 'orders.json'
 # New file to store forms data
 FORMS_FILE = 'forms.json'
+# Append order mutations to orders.json.journal instead of rewriting orders.json
+ORDERS_JOURNAL = os.environ.get('ORDERS_JOURNAL', '0') == '1'
+# Fold the journal back into orders.json after this many records
+ORDERS_JOURNAL_COMPACT_EVERY = int(os.environ.get('ORDERS_JOURNAL_COMPACT_EVERY', '500'))
+# Storage backend: 'json' (the files above), 'sharded' (FORMS_FILE plus one
+# orders file per form in ORDERS_DIR) or 'sqlite' (SQLITE_FILE)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
+ORDERS_DIR = 'orders'
+SQLITE_FILE = 'bakery.db'
+# Set MULTI_PROCESS=1 when running several workers (e.g. gunicorn -w 4 index:app;
+# with SSE_ENABLED use threaded workers: gunicorn -w 4 -k gthread --threads 32).
+# Workers then coordinate through SHARED_STATE_FILE: flock locks around every
+# mutation and shared generation counters that trigger lazy reloads.
+MULTI_PROCESS = os.environ.get('MULTI_PROCESS', '0') == '1'
+SHARED_STATE_FILE = 'data.lock'
+# Store form products as references to generic_products plus the fields
+# each form overrides (run 'flask normalize-forms' once to convert)
+FORMS_CATALOG = os.environ.get('FORMS_CATALOG', '0') == '1'
+# Change feed for /api/changes: how many recent changes stay available, and
+# the log file the workers share in multi-process mode
+CHANGE_FEED_RETENTION = int(os.environ.get('CHANGE_FEED_RETENTION', '1000'))
+CHANGE_LOG_FILE = 'changes.log'
+# Live stock streams (/api/forms/<form>/stock/events). Each open stream holds
+# a request thread for up to SSE_MAX_SECONDS, so only set SSE_ENABLED=1 under a
+# threaded or async server (flask run, gunicorn -k gthread or -k gevent), never
+# with gunicorn's default sync workers. SSE_MAX_STREAMS caps the streams of one
+# process so they cannot take every thread. When disabled or full the route
+# answers 503 and the browser polls /api/forms/<form>/stock instead.
+SSE_ENABLED = os.environ.get('SSE_ENABLED', '0') == '1'
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', '16'))
+# Seconds between heartbeats, between stock re-checks in multi-process mode
+# (other workers' commits cannot wake this process), and before a stream is
+# closed so the browser reconnects (frees the worker thread of abandoned tabs).
+SSE_HEARTBEAT = float(os.environ.get('SSE_HEARTBEAT', '15'))
+SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', '2'))
+SSE_MAX_SECONDS = float(os.environ.get('SSE_MAX_SECONDS', '300'))
+# Past forms moved out of the hot data by 'flask archive-forms' or POST
+# /api/archive: one gzip file per form, read back lazily by the GET routes,
+# with the most recently read ARCHIVE_CACHE_SIZE forms kept in memory
+ARCHIVE_DIR = 'archive'
+ARCHIVE_CACHE_SIZE = int(os.environ.get('ARCHIVE_CACHE_SIZE', '16'))
 UPLOAD_FOLDER = 'images'
+# How image bytes leave the process: '' streams them from Flask, 'x-sendfile'
+# (Apache/lighttpd) or 'x-accel' (nginx) hand the file to the reverse proxy.
+# For x-accel, IMAGE_ACCEL_PREFIX must be an internal nginx location whose
+# alias is the images folder.
+IMAGE_SENDFILE = os.environ.get('IMAGE_SENDFILE', '')
+IMAGE_ACCEL_PREFIX = os.environ.get('IMAGE_ACCEL_PREFIX', '/protected-images')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# Opt-in request profiling. PROFILE_SAMPLE=N profiles one in N requests to
+# the PROFILE_ROUTES endpoints; with PROFILE_TOKEN set, any request sending
+# "X-Profile: <token>" is profiled. PROFILE_MODE is 'cprofile' (.pstats) or
+# 'sample' (collapsed stacks for flamegraphs); dumps go to PROFILE_DIR.
+PROFILE_ROUTES = os.environ.get('PROFILE_ROUTES', 'create_order,get_products,move_order').split(',')
+PROFILE_SAMPLE = int(os.environ.get('PROFILE_SAMPLE', '0'))
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN', '')
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')
+PROFILE_DIR = 'profiles'
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '50'))
+# Serialized GET bodies kept per data version (see versioned())
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', '256'))
 
 # This section needs to be added to your Flask backend after the app = Flask(__name__) line
 # to modify the product template
@@ -39,44 +120,323 @@ if not os.path.exists(FORMS_FILE):
         # Initialize with the default product data
         json.dump(product_data, f, indent=2)
 
-def read_forms():
-    """Read forms from JSON file"""
-    if os.path.exists(FORMS_FILE):
-        with open(FORMS_FILE, 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                # If file is corrupted, return default data
-                return copy.deepcopy(product_data)
+def json_storage():
+    return JsonStorage(FORMS_FILE, ORDERS_FILE, product_data,
+                       journal=ORDERS_JOURNAL,
+                       compact_every=ORDERS_JOURNAL_COMPACT_EVERY)
+
+shared_state = SharedState(SHARED_STATE_FILE) if MULTI_PROCESS else None
+change_feed = ChangeFeed(CHANGE_FEED_RETENTION, CHANGE_LOG_FILE if MULTI_PROCESS else None)
+
+if STORAGE_BACKEND == 'sqlite':
+    store = DataStore(SqliteStorage(SQLITE_FILE, product_data), shared_state, change_feed, FORMS_CATALOG)
+elif STORAGE_BACKEND == 'sharded':
+    store = DataStore(ShardedJsonStorage(FORMS_FILE, ORDERS_DIR, product_data, ORDERS_FILE), shared_state,
+                      change_feed, FORMS_CATALOG)
+else:
+    store = DataStore(json_storage(), shared_state, change_feed, FORMS_CATALOG)
+cold_store = ColdStore(ARCHIVE_DIR, ARCHIVE_CACHE_SIZE)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+profiler = RequestProfiler(PROFILE_DIR, PROFILE_ROUTES, PROFILE_SAMPLE, PROFILE_TOKEN, PROFILE_MODE,
+                           keep=PROFILE_KEEP,
+                           data_size=lambda: sum(len(form["orders"]) for form in read_orders().values()))
+
+@app.before_request
+def start_profiler():
+    if profiler.enabled:
+        g.profile = profiler.start(request)
+
+@app.teardown_request
+def finish_profiler(exc):
+    handle = g.pop('profile', None)
+    if handle is not None:
+        profiler.finish(handle, request.endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    """Per-route latency and body sizes for /api/metrics"""
+    route = request.url_rule.rule if request.url_rule else '<unmatched>'
+    started = g.get('request_started')
+    if started is not None:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                        request.method, route, response.status_code)
+    metrics.REQUEST_BYTES.observe(request.content_length or 0, request.method, route)
+    metrics.RESPONSE_BYTES.observe(response.content_length or 0, request.method, route)
+    return response
+
+stock_events = StockBroadcaster()
+stock_stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+def publish_stock_change(change):
+    """Wake the stock streams of the forms a committed change touched"""
+    if "form" in change:
+        stock_events.publish({change["form"], change.get("target", change["form"])})
     else:
-        # If file doesn't exist, create it with default data
-        forms_data = copy.deepcopy(product_data)
-        with open(FORMS_FILE, 'w') as f:
-            json.dump(forms_data, f, indent=2)
-        return forms_data
+        stock_events.publish()
+
+store.listeners.append(publish_stock_change)
+
+def read_forms():
+    """Read forms from the in-memory store (re-parsed only when the file changes)"""
+    return store.forms()
+
+def editing_forms():
+    """Private copy of the forms document for a read-modify-write (see DataStore.editing_forms)"""
+    return store.editing_forms()
 
 def write_forms(forms_data):
     """Write forms to JSON file"""
-    with open(FORMS_FILE, 'w') as f:
-        json.dump(forms_data, f, indent=2)
+    store.write_forms(forms_data)
 
 def read_orders():
-    """Read orders from JSON file"""
-    with open(ORDERS_FILE, 'r') as f:
-        return json.load(f)
+    """Read orders from the in-memory store (re-parsed only when the file changes)"""
+    return store.orders()
+
+def commit_orders(op):
+    """Apply one order mutation and persist it (journal append or full rewrite)"""
+    store.commit_orders(op)
+
+
+def form_products(forms_data, form_name):
+    """Return a form's product list for both the new and the old (bare list) format"""
+    form = forms_data.get(form_name)
+    if isinstance(form, dict):
+        return form.get("products", [])
+    return form or []
+
+def inventory_shortage(form_name, selected_products, previous_products=None, reserved=None):
+    """Check that a form can still supply the requested quantities.
+
+    Returns (product name, remaining units) for the first product that would
+    be oversold, or None. Quantities in previous_products (the order being
+    replaced) are already reserved, so only increases over them are checked.
+    ``reserved`` maps product name -> units taken by not yet committed
+    changes (negative when they free stock).
+    Call it inside store.transaction(form_name) together with the commit.
+    """
+    stock = store.stock(form_name) or {}
+    reserved = reserved or {}
+    for product_name, product in selected_products.items():
+        if product_name not in stock:
+            continue
+        requested = sum(product["extras"].values())
+        if previous_products and product_name in previous_products:
+            requested -= sum(previous_products[product_name]["extras"].values())
+        if requested <= 0:
+            continue
+        remaining = max(stock[product_name]["remaining"] - reserved.get(product_name, 0), 0)
+        if requested > remaining:
+            return product_name, remaining
+    return None
 
-def write_orders(orders):
-    """Write orders to JSON file"""
-    with open(ORDERS_FILE, 'w') as f:
-        json.dump(orders, f, indent=2)
+
+def archive_candidates(days):
+    """Forms whose name dates them more than ``days`` days in the past"""
+    cutoff = datetime.now().date().toordinal() - days
+    candidates = []
+    for form_name in read_forms():
+        if form_name == "generic_products":
+            continue
+        bake_date = form_date(form_name)
+        if bake_date is not None and bake_date.toordinal() < cutoff:
+            candidates.append(form_name)
+    return candidates
+
+def archive_forms(form_names):
+    """Move forms and their orders to the cold store; returns the archived names.
+
+    Each form is written to the archive before it leaves the hot data, so a
+    crash in between leaves a form in both places, never in neither. Forms
+    whose name is already archived stay where they are.
+    """
+    with store.transaction(*form_names), editing_forms() as forms_data:
+        orders_data = read_orders()
+        archived = [name for name in form_names
+                    if name in forms_data and name != "generic_products" and name not in cold_store]
+        if not archived:
+            return []
+        for form_name in archived:
+            form_orders = orders_data.get(form_name, {"orders": [], "products": {}})
+            cold_store.save(form_name, forms_data[form_name], form_orders, form_date(form_name))
+        write_forms({name: form for name, form in forms_data.items() if name not in archived})
+        for form_name in archived:
+            if form_name in orders_data:
+                commit_orders({"op": "drop_form", "form": form_name})
+    return archived
+
+def archived_form(form_name):
+    """The cold store copy of a form that is no longer in the hot data, or None"""
+    if form_name in read_forms() or form_name not in cold_store:
+        return None
+    return cold_store.load(form_name)
+
+
+response_cache = OrderedDict()
+response_cache_lock = threading.Lock()
+
+def versioned(*docs, images=False):
+    """Serve a GET route with conditional-request support driven by the data version.
+
+    The response carries an ETag built from store.data_version(*docs) and a
+    Last-Modified of the newest document. A matching If-None-Match (or
+    If-Modified-Since) gets a 304 before the view runs, and bodies are cached
+    per URL and version, so repeated polls never re-serialize unchanged data.
+    With ``images`` the version also follows the images folder, for routes
+    that embed image versions.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version, modified = store.data_version(*docs)
+            if images:
+                version = f"{version}-{image_index.signature()}"
+            key = request.full_path
+            with response_cache_lock:
+                cached = response_cache.get(key)
+                if cached is not None and cached[0] == version:
+                    response_cache.move_to_end(key)
+            if cached is None or cached[0] != version:
+                response = app.make_response(view(*args, **kwargs))
+                if response.is_streamed:
+                    # Never buffer streamed bodies
+                    return response
+                cached = (version, response.get_data(), response.status_code, response.mimetype)
+                with response_cache_lock:
+                    response_cache[key] = cached
+                    response_cache.move_to_end(key)
+                    if len(response_cache) > RESPONSE_CACHE_SIZE:
+                        response_cache.popitem(last=False)
+            response = app.response_class(cached[1], status=cached[2], mimetype=cached[3])
+            if response.status_code == 200:
+                response.set_etag(version)
+                response.last_modified = datetime.fromtimestamp(int(modified), timezone.utc)
+                # Clients may keep the body but must revalidate it every time
+                response.cache_control.no_cache = True
+                response = response.make_conditional(request)
+            return response
+        return wrapper
+    return decorator
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request and storage metrics of this process, in Prometheus text format"""
+    return app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.cli.command('compact-orders')
+def compact_orders_command():
+    """Fold the orders journal (or SQLite WAL) into the main data file"""
+    store.compact()
+    print("Compacted orders storage")
+
+
+@app.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """Recompute every form's product aggregates from its orders (repair)"""
+    orders = store.rebuild_aggregates()
+    print(f"Rebuilt aggregates for {len(orders)} forms")
+
+
+@app.cli.command('normalize-forms')
+def normalize_forms_command():
+    """Rewrite the forms document with products as catalog references"""
+    store.normalize = True
+    with editing_forms() as forms_data:
+        size_before = len(json.dumps(forms_data))
+        write_forms(forms_data)
+    size_after = len(json.dumps(store.storage.load_forms()))
+    print(f"Normalized {len(forms_data)} forms ({size_before} -> {size_after} bytes of JSON)")
+    if not FORMS_CATALOG:
+        print("Set FORMS_CATALOG=1 so later writes stay normalized")
+
+
+@app.cli.command('migrate-sharded')
+def migrate_sharded_command():
+    """Split orders.json into one orders file per form under ORDERS_DIR"""
+    orders = migrate_json_to_sharded(json_storage(), ShardedJsonStorage(FORMS_FILE, ORDERS_DIR, product_data))
+    print(f"Wrote {len(orders)} form order files to {ORDERS_DIR}/")
+
+
+@app.cli.command('migrate-sqlite')
+def migrate_sqlite_command():
+    """Import forms.json/orders.json into the SQLite database"""
+    forms_data, orders = migrate_json_to_sqlite(json_storage(), SqliteStorage(SQLITE_FILE, product_data))
+    order_count = sum(len(form.get("orders", [])) for form in orders.values())
+    print(f"Imported {len(forms_data)} forms and {order_count} orders into {SQLITE_FILE}")
+
+
+@app.cli.command('archive-forms')
+@click.option('--days', default=0, show_default=True,
+              help='Archive forms whose name dates them more than this many days in the past.')
+@click.option('--dry-run', is_flag=True, help='Only list the forms that would be archived.')
+def archive_forms_command(days, dry_run):
+    """Move past forms and their orders to the compressed archive"""
+    candidates = archive_candidates(days)
+    if dry_run:
+        for form_name in candidates:
+            print(form_name)
+        print(f"{len(candidates)} forms would be archived")
+        return
+    archived = archive_forms(candidates)
+    print(f"Archived {len(archived)} forms to {ARCHIVE_DIR}/")
+
+
+@app.route('/api/archive', methods=['GET'])
+def get_archive():
+    """List archived forms with their bake day and order count"""
+    return jsonify({
+        "success": True,
+        "forms": [{"name": name, "date": entry["date"], "archivedAt": entry["archived_at"],
+                   "orderCount": len(entry["order_ids"])}
+                  for name, entry in cold_store.index().items()]
+    })
+
+
+@app.route('/api/archive', methods=['POST'])
+def archive_past_forms():
+    """Archive the given forms, or every form whose name dates it older than olderThanDays days"""
+    data = request.json or {}
+    if "forms" in data:
+        form_names = data["forms"]
+        if not isinstance(form_names, list) or "generic_products" in form_names:
+            return jsonify({
+                "success": False,
+                "error": "forms must be a list of form names"
+            }), 400
+    else:
+        try:
+            form_names = archive_candidates(int(data.get("olderThanDays", 0)))
+        except (TypeError, ValueError):
+            return jsonify({
+                "success": False,
+                "error": "olderThanDays must be a number"
+            }), 400
+    if data.get("dryRun"):
+        return jsonify({"success": True, "archived": [], "candidates": form_names})
+    return jsonify({
+        "success": True,
+        "archived": archive_forms(form_names)
+    })
 
 
 @app.route('/api/dates', methods=['GET'])
+@versioned('forms')
 def get_dates():
-    """Get available order dates"""
+    """Get available order dates (?archived=1 also lists the archived forms)"""
     forms_data = read_forms()
     # Filter out the generic_products key
     dates = [key for key in forms_data.keys() if key != "generic_products"]
+    if request.args.get('archived') == '1':
+        return jsonify({
+            "success": True,
+            "dates": dates,
+            "archived": [name for name in cold_store.index() if name not in forms_data]
+        })
     
     return jsonify({
         "success": True,
@@ -87,25 +447,24 @@ def get_dates():
 @app.route('/api/forms/<form_name>', methods=['DELETE'])
 def delete_form(form_name):
     """Delete a form"""
-    forms_data = read_forms()
-    
-    # Prevent deletion of generic_products
-    if form_name == "generic_products":
-        return jsonify({
-            "success": False,
-            "error": "Cannot delete generic products template"
-        }), 403
-    
-    # Check if form exists
-    if form_name not in forms_data:
-        return jsonify({
-            "success": False,
-            "error": "Form not found"
-        }), 404
-    
-    # Delete the form
-    del forms_data[form_name]
-    write_forms(forms_data)
+    with editing_forms() as forms_data:
+        # Prevent deletion of generic_products
+        if form_name == "generic_products":
+            return jsonify({
+                "success": False,
+                "error": "Cannot delete generic products template"
+            }), 403
+        
+        # Check if form exists
+        if form_name not in forms_data:
+            return jsonify({
+                "success": False,
+                "error": "Form not found"
+            }), 404
+        
+        # Delete the form
+        del forms_data[form_name]
+        write_forms(forms_data)
 
     orders_data = read_orders()
     
@@ -117,8 +476,8 @@ def delete_form(form_name):
         }), 404
     
     # Delete the form
-    del orders_data[form_name]
-    write_orders(orders_data)
+    with store.transaction(form_name):
+        commit_orders({"op": "drop_form", "form": form_name})
     
     return jsonify({
         "success": True,
@@ -137,39 +496,39 @@ def add_product_to_form(form_name):
             "error": "Product data is required"
         }), 400
     
-    forms_data = read_forms()
-    
-    # Check if form exists
-    if form_name not in forms_data:
-        return jsonify({
-            "success": False,
-            "error": "Form not found"
-        }), 404
-    
-    # Add existent flag if not present
-    new_product = data['product']
-    if 'existent' not in new_product:
-        new_product['existent'] = True
+    with editing_forms() as forms_data:
     
-    # Get current products
-    if isinstance(forms_data[form_name], dict) and "products" in forms_data[form_name]:
-        current_products = forms_data[form_name]["products"]
-        metadata = forms_data[form_name].get("metadata", {"visible": True})
-    else:
-        # Handle old format
-        current_products = forms_data[form_name]
-        metadata = {"visible": True}
+        # Check if form exists
+        if form_name not in forms_data:
+            return jsonify({
+                "success": False,
+                "error": "Form not found"
+            }), 404
+    
+        # Add existent flag if not present
+        new_product = data['product']
+        if 'existent' not in new_product:
+            new_product['existent'] = True
+    
+        # Get current products
+        if isinstance(forms_data[form_name], dict) and "products" in forms_data[form_name]:
+            current_products = forms_data[form_name]["products"]
+            metadata = forms_data[form_name].get("metadata", {"visible": True})
+        else:
+            # Handle old format
+            current_products = forms_data[form_name]
+            metadata = {"visible": True}
     
-    # Add new product to the list
-    current_products.append(new_product)
+        # Add new product to the list
+        current_products.append(new_product)
     
-    # Update form with new products
-    forms_data[form_name] = {
-        "products": current_products,
-        "metadata": metadata
-    }
+        # Update form with new products
+        forms_data[form_name] = {
+            "products": current_products,
+            "metadata": metadata
+        }
     
-    write_forms(forms_data)
+        write_forms(forms_data)
     
     return jsonify({
         "success": True,
@@ -193,6 +552,11 @@ def create_order():
     
     # Create order object
     form_name = data['date']
+    if not isinstance(form_name, str) or form_name not in read_orders():
+        return jsonify({
+            "success": False,
+            "error": "Form not found"
+        }), 404
 
     selected_prods = {k: v for k,v in data['selectedProducts'].items() if v["selected"]}
     new_selected_prods = {}
@@ -204,7 +568,7 @@ def create_order():
 
 
     order = {
-        "id": str(datetime.now().timestamp()),
+        "id": store.new_order_id(),
         "name": data['name'],
         "phone": data['phone'],
         "date": data['date'],
@@ -214,34 +578,180 @@ def create_order():
         "timestamp": datetime.now().isoformat()
     }
     
-    # Read existing orders
-    orders = read_orders()
-    
-    # Add new order
-    orders[form_name]["orders"].append(order)
-    for prod_name,product in order["selectedProducts"].items():
-        if prod_name not in orders[form_name]["products"]:
-            orders[form_name]["products"][prod_name] = {"total_amount":0, "extras": {}}
-        for extra_name,amount in product["extras"].items():
-            if extra_name not in orders[form_name]["products"][prod_name]["extras"]:
-                orders[form_name]["products"][prod_name]["extras"][extra_name] = {"amount":0, "names": []}
-            
-            orders[form_name]["products"][prod_name]["extras"][extra_name]["amount"] += amount
-            orders[form_name]["products"][prod_name]["extras"][extra_name]["names"].append(order["name"])
-            orders[form_name]["products"][prod_name]["total_amount"] += amount
+    # Check stock and commit under the form's lock so concurrent orders
+    # for the same bake day cannot oversell
+    with store.transaction(form_name):
+        if form_name not in read_orders():
+            return jsonify({
+                "success": False,
+                "error": "Form not found"
+            }), 404
 
-    # Write updated orders
-    write_orders(orders)
+        shortage = inventory_shortage(form_name, selected_prods)
+        if shortage:
+            product_name, remaining = shortage
+            return jsonify({
+                "success": False,
+                "error": f"Not enough inventory for '{product_name}' (only {remaining} available)"
+            }), 409
+
+        # Add new order and its quantities to the form's aggregates
+        commit_orders({"op": "create", "form": form_name, "order": order})
     
     return jsonify({
         "success": True,
         "order": order
     })
 
+ORDER_QUERY_PARAMS = {'form', 'phone', 'name', 'product', 'since', 'until',
+                      'fields', 'limit', 'cursor', 'format'}
+ORDERS_PAGE_LIMIT = 100
+ORDERS_MAX_PAGE_LIMIT = 1000
+# Cursor form position of orders read from an archived form
+ARCHIVED_FORM_POS = -1
+
+def encode_cursor(form_pos, form_name, position, order_id):
+    raw = json.dumps([form_pos, form_name, position, order_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def cursor_start(cursor):
+    """Resume point (form position, order position) just after a cursor's order"""
+    form_pos, form_name, position, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if form_pos == ARCHIVED_FORM_POS:
+        # Archived orders never change position
+        return form_pos, position + 1
+    found_form, found_idx, _ = store.find_order(order_id)
+    names = list(read_orders())
+    if found_form == form_name:
+        return names.index(form_name), found_idx + 1
+    if form_name in names:
+        # The order was removed or moved: continue from its old slot
+        return names.index(form_name), position
+    return form_pos, 0
+
+def parse_timestamp_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    stamp = datetime.fromisoformat(value)
+    # Order timestamps are naive local time; compare offsets/Z in that frame
+    if stamp.tzinfo is not None:
+        stamp = stamp.astimezone().replace(tzinfo=None)
+    return stamp
+
+def query_orders():
+    """Filtered, paginated and projected GET /api/orders (see get_orders)"""
+    args = request.args
+    try:
+        since = parse_timestamp_arg('since')
+        until = parse_timestamp_arg('until')
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "since/until must be ISO timestamps"
+        }), 400
+    streaming = args.get('format') == 'ndjson'
+    try:
+        limit = int(args['limit']) if 'limit' in args else (None if streaming else ORDERS_PAGE_LIMIT)
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "limit must be a number"
+        }), 400
+    if limit is not None and limit < 1:
+        return jsonify({
+            "success": False,
+            "error": "limit must be at least 1"
+        }), 400
+    if limit is not None and not streaming:
+        limit = min(limit, ORDERS_MAX_PAGE_LIMIT)
+    try:
+        start = cursor_start(args['cursor']) if args.get('cursor') else (0, 0)
+    except (ValueError, TypeError):
+        return jsonify({
+            "success": False,
+            "error": "Invalid cursor"
+        }), 400
+
+    form_filter = args.get('form') or args.get('date')
+    phone = args.get('phone')
+    name = args.get('name', '').casefold()
+    product = args.get('product')
+    fields = [f for f in args.get('fields', '').split(',') if f]
+
+    def matches(form_name, order):
+        if form_filter and form_name != form_filter:
+            return False
+        if phone and order.get("phone") != phone:
+            return False
+        if name and name not in order.get("name", "").casefold():
+            return False
+        if product and product not in order.get("selectedProducts", {}):
+            return False
+        if since or until:
+            try:
+                stamp = datetime.fromisoformat(order["timestamp"])
+            except (KeyError, ValueError):
+                return False
+            if (since and stamp < since) or (until and stamp >= until):
+                return False
+        return True
+
+    def project(order):
+        if not fields:
+            return order
+        return {"id": order["id"], **{f: order[f] for f in fields if f in order}}
+
+    def candidates():
+        archived = archived_form(form_filter) if form_filter and form_filter not in read_orders() else None
+        if archived is None:
+            return store.iter_orders(start)
+        offset = start[1] if start[0] == ARCHIVED_FORM_POS else 0
+        return ((ARCHIVED_FORM_POS, form_filter, position, order)
+                for position, order in enumerate(archived["orders"]["orders"][offset:], offset))
+
+    def results():
+        """Yield (cursor, projected order) for the matching orders"""
+        count = 0
+        for form_pos, form_name, position, order in candidates():
+            if not matches(form_name, order):
+                continue
+            yield encode_cursor(form_pos, form_name, position, order["id"]), project(order)
+            count += 1
+            if limit is not None and count >= limit:
+                return
+
+    if streaming:
+        # One JSON document per line, serialized as it is sent
+        def lines():
+            for _, order in results():
+                yield json.dumps(order) + '\n'
+        return Response(lines(), mimetype='application/x-ndjson')
+
+    page = list(results())
+    next_cursor = page[-1][0] if limit is not None and len(page) == limit else None
+    return jsonify({
+        "success": True,
+        "orders": [order for _, order in page],
+        "nextCursor": next_cursor
+    })
+
 @app.route('/api/orders', methods=['GET'])
+@versioned('orders')
 def get_orders():
-    """Get all orders"""
-    # print("Here!")
+    """Get all orders.
+
+    Without query parameters (or with only ?date=) this returns the whole
+    orders document as before. Any of form, phone, name (substring),
+    product, since/until (ISO timestamps, until exclusive), fields (comma
+    separated; id is always included), limit and cursor switch to a flat,
+    paginated list: {"orders": [...], "nextCursor": ...}. format=ndjson
+    streams every match (or up to limit) as one JSON order per line.
+    Archived forms are only included when selected with date= or form=.
+    """
+    if ORDER_QUERY_PARAMS & set(request.args):
+        return query_orders()
+
     orders = read_orders()
     
     # Optional date filter
@@ -249,6 +759,8 @@ def get_orders():
     if date_filter:
         if date_filter in orders:
             orders = orders[date_filter]
+        elif archived_form(date_filter) is not None:
+            orders = archived_form(date_filter)["orders"]
         else:
             orders = []
     
@@ -258,6 +770,306 @@ def get_orders():
     })
 
 
+# One CSV row per ordered extra; import groups consecutive rows of an order
+ORDER_CSV_COLUMNS = ['form', 'id', 'name', 'phone', 'comment', 'totalAmount', 'timestamp',
+                     'product', 'extra', 'amount']
+
+def order_csv_rows(form_name, order):
+    base = [form_name, order["id"], order.get("name", ""), order.get("phone", ""),
+            order.get("comment", ""), order.get("totalAmount", 0), order.get("timestamp", "")]
+    rows = [base + [product_name, extra_name, amount]
+            for product_name, product in order.get("selectedProducts", {}).items()
+            for extra_name, amount in product.get("extras", {}).items()]
+    return rows or [base + ['', '', '']]
+
+def exported_orders(form_filter, first_day, last_day):
+    """Yield (form name, order) for a form or a range of bake days, archive included"""
+    def in_range(bake_date):
+        return (bake_date is not None and (first_day is None or bake_date >= first_day)
+                and (last_day is None or bake_date <= last_day))
+
+    selected = {}
+    for _, form_name, _, order in store.iter_orders():
+        if form_name not in selected:
+            selected[form_name] = (form_name == form_filter if form_filter
+                                   else in_range(form_date(form_name)))
+        if selected[form_name]:
+            yield form_name, order
+    for form_name, entry in cold_store.index().items():
+        if form_name in selected:
+            continue
+        if form_filter:
+            wanted = form_name == form_filter
+        else:
+            wanted = in_range(calendar_date.fromisoformat(entry["date"]) if entry["date"] else None)
+        archived = archived_form(form_name) if wanted else None
+        for order in archived["orders"]["orders"] if archived else []:
+            yield form_name, order
+
+@app.route('/api/orders/export', methods=['GET'])
+def export_orders():
+    """Stream the orders of one form (?form=) or of the bake days ?from=&to=
+    (YYYY-MM-DD, inclusive) as CSV (default) or NDJSON (?format=ndjson).
+
+    Rows are generated one by one while the response is sent.
+    """
+    form_filter = request.args.get('form') or request.args.get('date')
+    try:
+        first_day = calendar_date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        last_day = calendar_date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "from/to must be YYYY-MM-DD dates"
+        }), 400
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({
+            "success": False,
+            "error": "format must be csv or ndjson"
+        }), 400
+
+    orders = exported_orders(form_filter, first_day, last_day)
+    if export_format == 'ndjson':
+        def lines():
+            for _, order in orders:
+                yield json.dumps(order, ensure_ascii=False) + '\n'
+        response = Response(lines(), mimetype='application/x-ndjson')
+    else:
+        def lines():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(ORDER_CSV_COLUMNS)
+            for form_name, order in orders:
+                writer.writerows(order_csv_rows(form_name, order))
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        response = Response(lines(), mimetype='text/csv')
+    filename = f"orders-{form_filter or 'export'}.{export_format}".replace('/', '_')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{urllib.parse.quote(filename)}"
+    return response
+
+
+def parse_import(body, content_type):
+    """Raw order entries of an import body: JSON (a list or {"orders": [...]}),
+    NDJSON (one order per line) or CSV (ORDER_CSV_COLUMNS rows)"""
+    if 'csv' in content_type:
+        entries = []
+        previous_key = None
+        for row in csv.DictReader(io.StringIO(body)):
+            key = tuple(row.get(column) or '' for column in ('form', 'id', 'name', 'phone'))
+            if key != previous_key:
+                entries.append({
+                    "date": row.get('form'), "id": row.get('id') or None, "name": row.get('name'),
+                    "phone": row.get('phone'), "comment": row.get('comment') or '',
+                    "totalAmount": row.get('totalAmount') or 0,
+                    "timestamp": row.get('timestamp') or None, "selectedProducts": {}
+                })
+                previous_key = key
+            if row.get('product'):
+                extras = entries[-1]["selectedProducts"].setdefault(row['product'], {"extras": {}})["extras"]
+                extras[row.get('extra') or ''] = row.get('amount')
+        return entries
+    if 'ndjson' in content_type or 'jsonl' in content_type:
+        return [json.loads(line) for line in body.splitlines() if line.strip()]
+    data = json.loads(body)
+    return data.get("orders", []) if isinstance(data, dict) else data
+
+def clean_selected_products(products):
+    """{product: {"extras": {extra: units}}} of the selected products, or raises ValueError.
+
+    Units must be non-negative integers (zero is dropped): stock checks and
+    aggregates add them up as they are.
+    """
+    if not isinstance(products, dict):
+        raise ValueError("selectedProducts must be an object")
+    selected_prods = {}
+    for prod_name, prod in products.items():
+        if not isinstance(prod, dict) or not prod.get("selected", True):
+            continue
+        if not isinstance(prod.get("extras", {}), dict):
+            raise ValueError(f"extras of '{prod_name}' must be an object")
+        extras = {}
+        for extra_name, amount in prod.get("extras", {}).items():
+            try:
+                amount = int(amount)
+            except (TypeError, ValueError):
+                raise ValueError(f"Invalid amount for '{prod_name}' / '{extra_name}'")
+            if amount < 0:
+                raise ValueError(f"Negative amount for '{prod_name}' / '{extra_name}'")
+            if amount > 0:
+                extras[extra_name] = amount
+        selected_prods[prod_name] = {"extras": extras}
+    return selected_prods
+
+def import_entry(entry, default_form):
+    """Validate one imported order; returns (form name, order) or raises ValueError"""
+    if not isinstance(entry, dict):
+        raise ValueError("Order must be an object")
+    form_name = entry.get("date") or entry.get("form") or default_form
+    for field, value in (("name", entry.get("name")), ("phone", entry.get("phone")), ("date", form_name)):
+        if not value:
+            raise ValueError(f"Missing required field: {field}")
+    if not isinstance(form_name, str):
+        raise ValueError("date must be a form name")
+    selected_prods = clean_selected_products(entry.get("selectedProducts", {}))
+    try:
+        total_amount = float(entry.get("totalAmount") or 0)
+    except (TypeError, ValueError):
+        raise ValueError("totalAmount must be a number")
+    order = {
+        "id": str(entry["id"]) if entry.get("id") else None,
+        "name": entry["name"],
+        "phone": str(entry["phone"]),
+        "date": form_name,
+        "comment": entry.get("comment") or '',
+        "selectedProducts": selected_prods,
+        "totalAmount": int(total_amount) if total_amount.is_integer() else total_amount,
+        "timestamp": entry.get("timestamp") or datetime.now().isoformat()
+    }
+    return form_name, order
+
+def import_orders(entries, default_form=None):
+    """Validate a batch of orders and commit it as one write.
+
+    All or nothing: returns (response body, status code). Orders whose id
+    already exists, archived orders included, are skipped, so re-running an
+    import is harmless. Inventory is checked for the whole batch at once.
+    """
+    errors = []
+    batch = []
+    for index_in_batch, entry in enumerate(entries):
+        try:
+            batch.append(import_entry(entry, default_form))
+        except ValueError as e:
+            errors.append({"index": index_in_batch, "error": str(e)})
+    if errors:
+        return {"success": False, "error": f"{len(errors)} invalid orders, nothing was imported",
+                "errors": errors}, 400
+
+    form_names = {form_name for form_name, _ in batch}
+    with store.transaction(*form_names):
+        orders_data = read_orders()
+        errors = [{"index": i, "error": f"Form '{form_name}' not found"}
+                  for i, (form_name, _) in enumerate(batch) if form_name not in orders_data]
+        if errors:
+            return {"success": False, "error": f"{len(errors)} invalid orders, nothing was imported",
+                    "errors": errors}, 400
+
+        ops = []
+        skipped = []
+        seen_ids = set()
+        requested = {}
+        for form_name, order in batch:
+            if order["id"] and (order["id"] in seen_ids or find_order(order["id"])[2] is not None
+                                or cold_store.find_order(order["id"])[1] is not None):
+                skipped.append(order["id"])
+                continue
+            order["id"] = order["id"] or store.new_order_id()
+            seen_ids.add(order["id"])
+            ops.append({"op": "create", "form": form_name, "order": order})
+            # The batch reserves stock as if it were one big order per form
+            form_requested = requested.setdefault(form_name, {})
+            for prod_name, prod in order["selectedProducts"].items():
+                units = form_requested.setdefault(prod_name, {"extras": {"": 0}})
+                units["extras"][""] += sum(prod["extras"].values())
+
+        for form_name, selected_prods in requested.items():
+            shortage = inventory_shortage(form_name, selected_prods)
+            if shortage:
+                product_name, remaining = shortage
+                return {"success": False,
+                        "error": f"Not enough inventory for '{product_name}' in '{form_name}' "
+                                 f"(only {remaining} available)"}, 409
+
+        if ops:
+            commit_orders({"op": "batch", "ops": ops})
+
+    return {"success": True, "imported": len(ops), "ids": [op["order"]["id"] for op in ops],
+            "skipped": skipped}, 200
+
+@app.route('/api/orders/import', methods=['POST'])
+def import_orders_route():
+    """Bulk-create orders from JSON, NDJSON or CSV (see ORDER_CSV_COLUMNS).
+
+    ?form= sets the form of entries that name none. The batch is validated
+    as a whole and committed with a single write.
+    """
+    try:
+        entries = parse_import(request.get_data(as_text=True), request.content_type or '')
+    except (ValueError, AttributeError) as e:
+        return jsonify({
+            "success": False,
+            "error": f"Could not parse import: {e}"
+        }), 400
+    body, status = import_orders(entries, request.args.get('form'))
+    return jsonify(body), status
+
+@app.cli.command('import-orders')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--form', default=None, help='Form of rows that name none.')
+def import_orders_command(path, form):
+    """Bulk-import orders from a .csv, .ndjson/.jsonl or .json file"""
+    with open(path, encoding='utf-8') as f:
+        body = f.read()
+    content_type = {'.csv': 'text/csv', '.ndjson': 'application/x-ndjson',
+                    '.jsonl': 'application/x-ndjson'}.get(os.path.splitext(path)[1], 'application/json')
+    result, status = import_orders(parse_import(body, content_type), form)
+    if status != 200:
+        print(result["error"])
+        for error in result.get("errors", []):
+            print(f"  order {error['index']}: {error['error']}")
+        raise SystemExit(1)
+    print(f"Imported {result['imported']} orders ({len(result['skipped'])} already present)")
+
+
+@app.route('/api/changes', methods=['GET'])
+def get_changes():
+    """Changes since ?since=<seq>, for dashboards that patch local state.
+
+    Without since, only the current epoch and seq are returned: read them
+    first, then load the full data, then poll with since=<seq>&epoch=<epoch>.
+    Entries carry a type (create, update, delete, move, add_form, drop_form,
+    forms_changed, orders_rebuilt), the order and the affected forms'
+    aggregates. 410 with reset=true means the changes are no longer
+    retained (or the server restarted): reload everything and start again.
+    """
+    since = request.args.get('since')
+    if since is None:
+        seq, _ = store.changes_since(0)
+        return jsonify({
+            "success": True,
+            "epoch": store.epoch,
+            "seq": seq,
+            "changes": []
+        })
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({
+            "success": False,
+            "error": "since must be a sequence number"
+        }), 400
+
+    seq, changes = store.changes_since(since)
+    epoch = request.args.get('epoch')
+    if changes is None or (epoch and epoch != store.epoch):
+        return jsonify({
+            "success": False,
+            "error": "Changes are no longer available, reload all data",
+            "reset": True,
+            "epoch": store.epoch,
+            "seq": seq
+        }), 410
+
+    # Entries are stored serialized; splice them into the response
+    body = '{"success":true,"epoch":%s,"seq":%d,"changes":[%s]}' % (
+        json.dumps(store.epoch), seq, ','.join(changes))
+    return app.response_class(body, mimetype='application/json')
+
+
 @app.route('/api/forms_visibility', methods=['PUT'])
 def update_forms_visibility():
     """Update visibility of forms"""
@@ -270,34 +1082,34 @@ def update_forms_visibility():
         }), 400
     
     visibility_data = data['visibility']
-    forms_data = read_forms()
+    with editing_forms() as forms_data:
     
-    # Create a new field for each form to store visibility if it doesn't exist
-    for form_name, is_visible in visibility_data.items():
-        # Skip if trying to update generic_products visibility
-        if form_name == "generic_products":
-            continue
+        # Create a new field for each form to store visibility if it doesn't exist
+        for form_name, is_visible in visibility_data.items():
+            # Skip if trying to update generic_products visibility
+            if form_name == "generic_products":
+                continue
             
-        # Skip if the form doesn't exist
-        if form_name not in forms_data:
-            continue
+            # Skip if the form doesn't exist
+            if form_name not in forms_data:
+                continue
             
-        # If the form exists, add or update metadata if it doesn't exist
-        if not isinstance(forms_data[form_name], dict) or "metadata" not in forms_data[form_name]:
-            # Convert products array to an object with products and metadata
-            products = forms_data[form_name]
-            forms_data[form_name] = {
-                "products": products,
-                "metadata": {
-                    "visible": is_visible
+            # If the form exists, add or update metadata if it doesn't exist
+            if not isinstance(forms_data[form_name], dict) or "metadata" not in forms_data[form_name]:
+                # Convert products array to an object with products and metadata
+                products = forms_data[form_name]
+                forms_data[form_name] = {
+                    "products": products,
+                    "metadata": {
+                        "visible": is_visible
+                    }
                 }
-            }
-        else:
-            # Update visibility in existing metadata
-            forms_data[form_name]["metadata"]["visible"] = is_visible
+            else:
+                # Update visibility in existing metadata
+                forms_data[form_name]["metadata"]["visible"] = is_visible
     
-    # Write updated forms data to file
-    write_forms(forms_data)
+        # Write updated forms data to file
+        write_forms(forms_data)
     
     return jsonify({
         "success": True,
@@ -345,19 +1157,30 @@ def upload_image():
     
     print(f"{filename=}")
 
-    # Save the file to the uploads folder
+    # Save the file to the uploads folder. Replacing it through a temp file
+    # changes the folder's mtime even when overwriting, which is how every
+    # worker's image index (and the imageVersion of cached responses) notices.
     file_path = os.path.join(UPLOAD_FOLDER, filename)
-    image_file.save(file_path)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    image_file.save(tmp_path)
+    os.replace(tmp_path, file_path)
+    image_index.add(filename)
+
+    # Pre-build the resized thumbnail/card/full variants (JPG and WebP)
+    try:
+        build_variants(UPLOAD_FOLDER, filename)
+    except Exception as e:
+        logger.exception(f"Could not build variants for {filename!r}: {str(e)}")
     
-    # Return success and the relative path
+    # Return success and the relative path, versioned by content so it can
+    # be cached forever
     return jsonify({
         "success": True,
-        "imagePath": f"/images/{filename}"
+        "imagePath": f"/images/{urllib.parse.quote(filename)}?v={image_index.content_hash(filename)}"
     })
 
 import os
 import urllib.parse
-import unicodedata
 import logging
 from flask import send_from_directory, jsonify
 
@@ -365,65 +1188,65 @@ from flask import send_from_directory, jsonify
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Normalized/case-folded name -> file, built once instead of listing the folder per request
+image_index = ImageIndex(UPLOAD_FOLDER)
+app.config['USE_X_SENDFILE'] = IMAGE_SENDFILE == 'x-sendfile'
+
+def send_image(relpath, original, version):
+    """Send an image file (an original or one of its variants) with a content-hash ETag.
+
+    A request whose ?v= matches the original's content hash can never change,
+    so it is cached as immutable; anything else must revalidate (cheap 304s).
+    """
+    etag = image_index.content_hash(relpath)
+    if IMAGE_SENDFILE == 'x-accel':
+        response = app.response_class(mimetype=mimetypes.guess_type(relpath)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{IMAGE_ACCEL_PREFIX}/{urllib.parse.quote(relpath)}"
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+    else:
+        response = send_from_directory(UPLOAD_FOLDER, relpath, etag=etag)
+    response.cache_control.public = True
+    if version is not None and version == image_index.content_hash(original):
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
 @app.route('/api/images/<path:filename>', methods=['GET'])
 def get_image(filename):
-    """Serve product images with proper Hebrew filename handling"""
+    """Serve product images with proper Hebrew filename handling.
+
+    Optional ?size=thumb|card|full and ?format=jpg|webp select a pre-built
+    variant; the original is served when that variant does not exist.
+    ?v=<content hash> (as returned by upload_image) makes the response immutable.
+    """
     try:
         # Decode URL-encoded filename
         decoded_filename = urllib.parse.unquote(filename)
-        logger.info(f"Requested image: {repr(decoded_filename)}")
         
         # Normalize Unicode and strip extra spaces
-        normalized_filename = unicodedata.normalize('NFC', decoded_filename).strip()
-        logger.info(f"Normalized filename: {repr(normalized_filename)}")
-        
-        # Try exact match first
-        exact_path = os.path.join(UPLOAD_FOLDER, normalized_filename)
-        if os.path.exists(exact_path):
-            logger.info(f"Serving exact match: {normalized_filename}")
-            return send_from_directory(UPLOAD_FOLDER, normalized_filename)
-        
-        # Try with .jpg extension
-        jpg_filename = normalized_filename + '.jpg'
-        jpg_path = os.path.join(UPLOAD_FOLDER, jpg_filename)
-        if os.path.exists(jpg_path):
-            logger.info(f"Serving JPG version: {jpg_filename}")
-            return send_from_directory(UPLOAD_FOLDER, jpg_filename)
+        normalized_filename = normalize_image_name(decoded_filename)
         
-        # Case-insensitive search for Hebrew filenames
-        if os.path.exists(UPLOAD_FOLDER):
-            for file in os.listdir(UPLOAD_FOLDER):
-                # Normalize and strip directory filenames
-                normalized_file = unicodedata.normalize('NFC', file).strip()
-                
-                # Compare normalized names
-                if normalized_filename == normalized_file:
-                    logger.info(f"Found normalized match: {file}")
-                    return send_from_directory(UPLOAD_FOLDER, file)
-                
-                # Compare with .jpg extension
-                if normalized_filename + '.jpg' == normalized_file:
-                    logger.info(f"Found normalized JPG match: {file}")
-                    return send_from_directory(UPLOAD_FOLDER, file)
-                
-                # Case-insensitive comparison
-                if normalized_filename.lower() == normalized_file.lower():
-                    logger.info(f"Found case-insensitive match: {file}")
-                    return send_from_directory(UPLOAD_FOLDER, file)
-                
-                # Case-insensitive comparison with .jpg extension
-                if (normalized_filename + '.jpg').lower() == normalized_file.lower():
-                    logger.info(f"Found case-insensitive JPG match: {file}")
-                    return send_from_directory(UPLOAD_FOLDER, file)
+        # Exact, .jpg, and case-insensitive matches all come from the index
+        found = image_index.lookup(normalized_filename)
+        if found is not None:
+            size = request.args.get('size')
+            if size in VARIANT_SIZES:
+                variant = find_variant(UPLOAD_FOLDER, found, size, request.args.get('format', 'jpg'))
+                if variant is not None:
+                    logger.debug(f"Serving {variant!r} for {decoded_filename!r}")
+                    return send_image(variant, found, request.args.get('v'))
+            logger.debug(f"Serving {found!r} for {decoded_filename!r}")
+            return send_image(found, found, request.args.get('v'))
         
-        # Log directory contents for debugging
-        files = os.listdir(UPLOAD_FOLDER)
-        logger.error(f"Image not found. Directory contents: {files}")
+        logger.info(f"Image not found: {normalized_filename!r}")
         
         return jsonify({
             "success": False,
             "error": f"Image not found: {normalized_filename}",
-            "searched_files": files,
             "normalized_request": normalized_filename,
             "original_request": decoded_filename
         }), 404
@@ -436,7 +1259,29 @@ def get_image(filename):
         }), 500
 
 
+@app.cli.command('backfill-images')
+@click.option('--force', is_flag=True, help='Rebuild variants even if they are up to date')
+def backfill_images_command(force):
+    """Build resized/WebP variants for every image already in the upload folder"""
+    image_index.refresh(force=True)
+    written = 0
+    for filename in sorted(os.listdir(UPLOAD_FOLDER)):
+        if not os.path.isfile(os.path.join(UPLOAD_FOLDER, filename)):
+            continue
+        try:
+            written += len(build_variants(UPLOAD_FOLDER, filename, force=force))
+        except Exception as e:
+            print(f"Skipping {filename}: {str(e)}")
+    print(f"Wrote {written} image variants")
+
+
+def image_version(product_name):
+    """Content hash of a product's image (the ?v= that makes it immutable), or None"""
+    found = image_index.lookup(normalize_image_name(product_name))
+    return image_index.content_hash(found) if found is not None else None
+
 @app.route('/api/products/generic_products', methods=['GET'])
+@versioned('forms', images=True)
 def get_generic_products():
     """Get generic products for homepage"""
     forms_data = read_forms()
@@ -444,7 +1289,8 @@ def get_generic_products():
     if "generic_products" in forms_data:
         # Return only products that exist
         existent_products = [
-            p for p in forms_data["generic_products"].get("products", [])
+            {**p, "imageVersion": image_version(p["name"])}
+            for p in forms_data["generic_products"].get("products", [])
             if p.get("existent", True)
         ]
         return jsonify({
@@ -471,44 +1317,46 @@ def create_form():
         }), 400
     
     form_name = data['formName']
-    forms_data = read_forms()
-    
-    # Check if form already exists
-    if form_name in forms_data:
-        return jsonify({
-            "success": False,
-            "error": "Form with this name already exists"
-        }), 409
+    with editing_forms() as forms_data:
     
-    # Create new form with products from generic_products
-    if "generic_products" in forms_data:
-        # Use generic products as template
-        if isinstance(forms_data["generic_products"], dict) and "products" in forms_data["generic_products"]:
-            template_products = copy.deepcopy(forms_data["generic_products"]["products"])
+        # Check if form already exists
+        if form_name in forms_data:
+            return jsonify({
+                "success": False,
+                "error": "Form with this name already exists"
+            }), 409
+        if form_name in cold_store:
+            return jsonify({
+                "success": False,
+                "error": "An archived form has this name"
+            }), 409
+    
+        # Create new form with products from generic_products
+        if "generic_products" in forms_data:
+            # Use generic products as template
+            if isinstance(forms_data["generic_products"], dict) and "products" in forms_data["generic_products"]:
+                template_products = copy.deepcopy(forms_data["generic_products"]["products"])
+            else:
+                template_products = copy.deepcopy(forms_data["generic_products"])
         else:
-            template_products = copy.deepcopy(forms_data["generic_products"])
-    else:
-        # Fallback to default product data if generic_products doesn't exist
-        template_products = copy.deepcopy(product_data["generic_products"])
-        # Add generic_products to forms_data
-        forms_data["generic_products"] = template_products
-    
-    # Create new form with the new structure including default comment
-    forms_data[form_name] = {
-        "products": template_products,
-        "metadata": {
-            "visible": True  # Default to visible
-        },
-        "comment": "The bread comes sliced unless you specify otherwise here. You can also add additional notes here."
-    }
-    
-    write_forms(forms_data)
-    
-    orders_data = read_orders()
+            # Fallback to default product data if generic_products doesn't exist
+            template_products = copy.deepcopy(product_data["generic_products"])
+            # Add generic_products to forms_data
+            forms_data["generic_products"] = template_products
+    
+        # Create new form with the new structure including default comment
+        forms_data[form_name] = {
+            "products": template_products,
+            "metadata": {
+                "visible": True  # Default to visible
+            },
+            "comment": "The bread comes sliced unless you specify otherwise here. You can also add additional notes here."
+        }
     
-    orders_data[form_name] = {"orders": [], "products": {}}
+        write_forms(forms_data)
     
-    write_orders(orders_data)
+    with store.transaction(form_name):
+        commit_orders({"op": "add_form", "form": form_name})
 
 
     return jsonify({
@@ -528,56 +1376,55 @@ def update_form(form_name):
             "error": "Products data is required"
         }), 400
     
-    forms_data = read_forms()
-
-    
-    # Check if form exists
-    if form_name not in forms_data:
-        return jsonify({
-            "success": False,
-            "error": "Form not found"
-        }), 404
-    
-    # Get existing metadata if available
-    metadata = {"visible": True}  # Default metadata
-    if isinstance(forms_data[form_name], dict) and "metadata" in forms_data[form_name]:
-        metadata = forms_data[form_name]["metadata"]
-    
-    # Get comment if provided, or use existing one, or use default
-    comment = data.get('comment', '')
-    if isinstance(forms_data[form_name], dict) and "comment" in forms_data[form_name]:
-        # Use existing comment if no new one provided
-        if not comment:
-            comment = forms_data[form_name]["comment"]
-    
-    products_data = read_orders()[form_name]["products"]
-
-    # Process products to ensure inventory and soldOut are set correctly
-    # IMPORTANT: Maintain the exact order that was sent from the frontend
-    processed_products = []
-    for product in data['products']:  # This maintains the order from the frontend
-        # Set default inventory to 12 if not provided
-        inventory = product.get('inventory', 12)
+    # Inventory changes are serialized with that form's order reservations
+    with store.transaction(form_name), editing_forms() as forms_data:
+        # Check if form exists
+        if form_name not in forms_data:
+            return jsonify({
+                "success": False,
+                "error": "Form not found"
+            }), 404
+    
+        # Get existing metadata if available
+        metadata = {"visible": True}  # Default metadata
+        if isinstance(forms_data[form_name], dict) and "metadata" in forms_data[form_name]:
+            metadata = forms_data[form_name]["metadata"]
+    
+        # Get comment if provided, or use existing one, or use default
+        comment = data.get('comment', '')
+        if isinstance(forms_data[form_name], dict) and "comment" in forms_data[form_name]:
+            # Use existing comment if no new one provided
+            if not comment:
+                comment = forms_data[form_name]["comment"]
+    
+        ordered = store.ordered(form_name)
+
+        # Process products to ensure inventory and soldOut are set correctly
+        # IMPORTANT: Maintain the exact order that was sent from the frontend
+        processed_products = []
+        for product in data['products']:  # This maintains the order from the frontend
+            # Set default inventory to 12 if not provided
+            inventory = product.get('inventory', 12)
         
-        # Ensure soldOut is set based on inventory
-        soldOut = (inventory == (products_data.get(product["name"], {}).get("total_amount", 0)))
+            # Ensure soldOut is set based on inventory
+            soldOut = ordered.get(product["name"], 0) >= inventory
         
-        processed_product = {
-            **product,
-            'inventory': inventory,
-            'soldOut': soldOut
+            processed_product = {
+                **product,
+                'inventory': inventory,
+                'soldOut': soldOut
+            }
+            processed_products.append(processed_product)
+    
+        # Update the form's products with the new structure including comment
+        # The order of products in the list will now match the UI order.
+        forms_data[form_name] = {
+            "products": processed_products,  # Order is preserved from frontend
+            "metadata": metadata,
+            "comment": comment
         }
-        processed_products.append(processed_product)
-    
-    # Update the form's products with the new structure including comment
-    # The order of products in the list will now match the UI order
-    forms_data[form_name] = {
-        "products": processed_products,  # Order is preserved from frontend
-        "metadata": metadata,
-        "comment": comment
-    }
-    
-    write_forms(forms_data)
+        
+        write_forms(forms_data)
     
     return jsonify({
         "success": True,
@@ -587,28 +1434,35 @@ def update_form(form_name):
 
 
 @app.route('/api/products/<date>', methods=['GET'])
+@versioned('forms', 'orders', images=True)
 def get_products(date):
-    """Get products for a specific date"""
-    forms_data = read_forms()
-
-    if date=="generic_products":
-        products_data = {}
-    else:
-        products_data = read_orders()[date]["products"]
-
-    print("products_data:")
-    print(products_data)
+    """Get products for a specific date (archived forms are read from the archive)"""
+    forms_data, stocks = store.forms_stock([date])
+    stock = stocks[date]
+
+    if date not in forms_data:
+        archived = archived_form(date)
+        if archived is not None:
+            # soldOut of a past form comes from its archived aggregates
+            forms_data = {date: archived["form"]}
+            counters = StockCounters()
+            counters.rebuild(forms_data, {date: archived["orders"]})
+            stock = counters.stock(date)
 
     if date in forms_data:
         # Check if the data structure has been updated
         if isinstance(forms_data[date], dict) and "products" in forms_data[date]:
-            # Ensure each product has an inventory (default to 12 if not set)
-            products = forms_data[date]["products"]
-            for product in products:
+            # Ensure each product has an inventory (default to 12 if not set).
+            # Work on copies - forms_data is the shared in-memory document.
+            products = []
+            for product in forms_data[date]["products"]:
+                product = {**product}
                 if 'inventory' not in product:
                     product['inventory'] = 12
-                # Update soldOut based on inventory
-                product['soldOut'] = (product.get('inventory', 0) == (products_data.get(product["name"], {}).get("total_amount", 0)))
+                # soldOut comes from the maintained stock counters
+                product['soldOut'] = stock[product["name"]]["soldOut"]
+                product['imageVersion'] = image_version(product["name"])
+                products.append(product)
             
             # Return products, metadata, and comment if available
             return jsonify({
@@ -632,55 +1486,195 @@ def get_products(date):
         }), 404
 
 
-@app.route('/api/udpate_sourdough', methods=['PUT'])
-def update_sourdough_amounts():
-    data = request.json
+@app.route('/api/storefront', methods=['GET'])
+@versioned('forms', 'orders')
+def get_storefront():
+    """Everything the order page needs to list dates, in one response.
 
-    forms_data = read_forms()
+    Returns the visible dates (all of them with ?all=1) with their metadata,
+    comment and a stock summary per product, replacing one /api/products
+    call per date.
+    """
+    include_hidden = request.args.get('all') == '1'
+    forms_data, stocks = store.forms_stock()
+
+    forms = []
+    for form_name, form in forms_data.items():
+        if form_name == "generic_products":
+            continue
+        if isinstance(form, dict) and "products" in form:
+            metadata = form.get("metadata", {"visible": True})
+            comment = form.get("comment", "The bread comes sliced unless you specify otherwise here. You can also add additional notes here.")
+        else:
+            metadata = {"visible": True}
+            comment = "The bread comes sliced unless you specify otherwise here. You can also add additional notes here."
+        if metadata.get("visible") is False and not include_hidden:
+            continue
 
-    if "generic_products" not in forms_data:
+        stock = stocks[form_name]
+        products = [
+            {"name": product["name"], "existent": product.get("existent", True), **stock[product["name"]]}
+            for product in form_products(forms_data, form_name)
+        ]
+
+        forms.append({
+            "date": form_name,
+            "metadata": metadata,
+            "comment": comment,
+            "products": products
+        })
+
+    return jsonify({
+        "success": True,
+        "forms": forms
+    })
+
+
+@app.route('/api/forms/<form_name>/stock', methods=['GET'])
+@versioned('forms', 'orders')
+def get_form_stock(form_name):
+    """Inventory, ordered and remaining units for each product of a form"""
+    stock = store.stock(form_name)
+    if stock is None:
         return jsonify({
             "success": False,
-            "error": "Generic products not found"
+            "error": "Form not found"
         }), 404
 
-    products = forms_data["generic_products"].get("products", [])
-
-    for i in range(len(products)):
-        product = products[i]
-        product_name = product["name"]
-        if product_name in data['amounts']:
-            update = data['amounts'][product_name]
-            # Update legacy fields
-            product["sourdough_black"] = update.get("black", 0)
-            product["sourdough_half_half"] = update.get("halfHalf", 0)
-            product["sourdough_white"] = update.get("white", 0)
-            # Update new fields
-            product["flour"] = update.get("flour", 0)
-            product["water"] = update.get("water", 0)
-            product["salt"] = update.get("salt", 0)
-            product["flours"] = update.get("flours", [])
+    return jsonify({
+        "success": True,
+        "formName": form_name,
+        "stock": stock
+    })
+
+
+@app.route('/api/forms/<form_name>/production_plan', methods=['GET'])
+@versioned('forms', 'orders')
+def get_production_plan(form_name):
+    """Dough, flour by type, water, salt and sourdough by starter for a form's orders.
+
+    Amounts are in the recipe units (grams), per product and in total.
+    """
+    plan = store.production_plan(form_name)
+    if plan is None:
+        archived = archived_form(form_name)
+        if archived is not None:
+            # Archived forms are planned with the current catalog recipes too
+            plan = production_plan({**read_forms(), form_name: archived["form"]}, form_name,
+                                   archived["orders"])
+    if plan is None:
+        return jsonify({
+            "success": False,
+            "error": "Form not found"
+        }), 404
+
+    return jsonify({
+        "success": True,
+        "formName": form_name,
+        **plan
+    })
+
+
+@app.route('/api/forms/<form_name>/stock/events', methods=['GET'])
+def stream_form_stock(form_name):
+    """Server-sent events with a form's remaining stock and soldOut flags.
+
+    A "stock" event with the full map is sent on connect and again whenever
+    an order commit changes the form; comment lines keep idle connections
+    alive. Clients without EventSource poll /api/forms/<form_name>/stock,
+    as do all clients while streams are disabled or SSE_MAX_STREAMS are open.
+    """
+    if store.stock(form_name) is None:
+        return jsonify({
+            "success": False,
+            "error": "Form not found"
+        }), 404
+    if not SSE_ENABLED or not stock_stream_slots.acquire(blocking=False):
+        return jsonify({
+            "success": False,
+            "error": "Live stock updates are unavailable, poll the stock endpoint"
+        }), 503
+
+    # Other workers' commits only show up through the shared generations
+    wait_timeout = min(SSE_HEARTBEAT, SSE_POLL_INTERVAL) if MULTI_PROCESS else SSE_HEARTBEAT
+
+    def events():
+        yield 'retry: 3000\n\n'
+        started = last_write = time.monotonic()
+        seen = stock_events.position(form_name)
+        sent = None
+        while time.monotonic() - started < SSE_MAX_SECONDS:
+            stock = store.stock(form_name)
+            if stock is None:
+                yield 'event: closed\ndata: {}\n\n'
+                return
+            summary = {name: {"remaining": s["remaining"], "soldOut": s["soldOut"]}
+                       for name, s in stock.items()}
+            if summary != sent:
+                sent = summary
+                last_write = time.monotonic()
+                yield f'event: stock\ndata: {json.dumps({"form": form_name, "stock": summary})}\n\n'
+            elif time.monotonic() - last_write >= SSE_HEARTBEAT:
+                last_write = time.monotonic()
+                yield ': heartbeat\n\n'
+            seen = stock_events.wait(form_name, seen, wait_timeout)
+
+    response = Response(events(), mimetype='text/event-stream')
+    # Runs when the server closes the response, even if it never started
+    response.call_on_close(stock_stream_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Tell nginx not to buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@app.route('/api/udpate_sourdough', methods=['PUT'])
+def update_sourdough_amounts():
+    data = request.json
+
+    with editing_forms() as forms_data:
+
+        if "generic_products" not in forms_data:
+            return jsonify({
+                "success": False,
+                "error": "Generic products not found"
+            }), 404
+
+        products = forms_data["generic_products"].get("products", [])
+
+        for i in range(len(products)):
+            product = products[i]
+            product_name = product["name"]
+            if product_name in data['amounts']:
+                update = data['amounts'][product_name]
+                # Update legacy fields
+                product["sourdough_black"] = update.get("black", 0)
+                product["sourdough_half_half"] = update.get("halfHalf", 0)
+                product["sourdough_white"] = update.get("white", 0)
+                # Update new fields
+                product["flour"] = update.get("flour", 0)
+                product["water"] = update.get("water", 0)
+                product["salt"] = update.get("salt", 0)
+                product["flours"] = update.get("flours", [])
             
-        products[i] = product
+            products[i] = product
 
-    forms_data["generic_products"]["products"] = products
-    write_forms(forms_data)
+        forms_data["generic_products"]["products"] = products
+        write_forms(forms_data)
 
     return jsonify({"success": True})
 
-# Helper function to find order by ID
+# Helper function to find order by ID (constant time via the store's id index)
 def find_order(order_id):
-    orders_data = read_orders()
-    for form_name, form_data in orders_data.items():
-        for idx, order in enumerate(form_data["orders"]):
-            if order["id"] == order_id:
-                return form_name, idx, order
-    return None, None, None
+    return store.find_order(order_id)
 
 # Get order by ID
 @app.route('/api/orders/<order_id>', methods=['GET'])
 def get_order(order_id):
     form_name, idx, order = find_order(order_id)
+    if not order:
+        # Orders of archived forms are read-only but still visible
+        form_name, order = cold_store.find_order(order_id)
     if not order:
         return jsonify({"success": False, "error": "Order not found"}), 404
     return jsonify({"success": True, "order": order})
@@ -693,23 +1687,37 @@ def update_order(order_id):
         return jsonify({"success": False, "error": "Order not found"}), 404
     
     data = request.json
-    orders_data = read_orders()
-    
-    # Update order details
-    updated_order = {
-        **old_order,
-        "phone": data.get("phone", old_order["phone"]),
-        "comment": data.get("comment", old_order["comment"]),
-        "selectedProducts": data.get("selectedProducts", old_order["selectedProducts"]),
-        "totalAmount": data.get("totalAmount", old_order["totalAmount"])
-    }
-    
-    # Replace the order in the list
-    orders_data[form_name]["orders"][idx] = updated_order
-    
-    # Recalculate aggregates
-    recalc_aggregates(orders_data, form_name)
-    write_orders(orders_data)
+    try:
+        selected_prods = (clean_selected_products(data["selectedProducts"])
+                          if "selectedProducts" in data else None)
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    
+    with store.transaction(form_name):
+        current_form, idx, old_order = find_order(order_id)
+        if current_form != form_name:
+            return jsonify({"success": False, "error": "Order was changed concurrently, please retry"}), 409
+
+        # Update order details
+        updated_order = {
+            **old_order,
+            "phone": data.get("phone", old_order["phone"]),
+            "comment": data.get("comment", old_order["comment"]),
+            "selectedProducts": old_order["selectedProducts"] if selected_prods is None else selected_prods,
+            "totalAmount": data.get("totalAmount", old_order["totalAmount"])
+        }
+
+        # Only quantities above what the order already holds need stock
+        shortage = inventory_shortage(form_name, updated_order["selectedProducts"], old_order["selectedProducts"])
+        if shortage:
+            product_name, remaining = shortage
+            return jsonify({
+                "success": False,
+                "error": f"Not enough inventory for '{product_name}' (only {remaining} available)"
+            }), 409
+        
+        # Replace the order in the list and adjust aggregates by the difference
+        commit_orders({"op": "update", "form": form_name, "id": order_id, "order": updated_order})
     
     return jsonify({"success": True, "order": updated_order})
 
@@ -720,32 +1728,12 @@ def remove_order(order_id):
     if not order:
         return jsonify({"success": False, "error": "Order not found"}), 404
     
-    orders_data = read_orders()
-    # Remove the order
-    del orders_data[form_name]["orders"][idx]
-    
-    # Recalculate aggregates
-    recalc_aggregates(orders_data, form_name)
-    write_orders(orders_data)
+    # Remove the order and subtract it from the aggregates
+    with store.transaction(form_name):
+        commit_orders({"op": "delete", "form": form_name, "id": order_id})
     
     return jsonify({"success": True})
 
-# Helper to recalculate aggregates after changes
-def recalc_aggregates(orders_data, form_name):
-    products_agg = {}
-    for order in orders_data[form_name]["orders"]:
-        for product_name, product in order["selectedProducts"].items():
-            if product_name not in products_agg:
-                products_agg[product_name] = {"total_amount":0, "extras": {}}
-            for extra_name, amount in product["extras"].items():
-                if extra_name not in products_agg[product_name]["extras"]:
-                    products_agg[product_name]["extras"][extra_name] = {"amount":0, "names": []}
-                products_agg[product_name]["extras"][extra_name]["amount"] += amount
-                products_agg[product_name]["extras"][extra_name]["names"].append(order["name"])
-            products_agg[product_name]["total_amount"] += amount
-    orders_data[form_name]["products"] = products_agg
-
-
 @app.route('/api/orders/products_ordered', methods=['GET'])
 def get_products_ordered():
     # Get form_name from query parameters
@@ -760,6 +1748,8 @@ def get_products_ordered():
     
     # Read orders data
     orders_data = read_orders()
+    if form_name not in orders_data and archived_form(form_name) is not None:
+        orders_data = {form_name: archived_form(form_name)["orders"]}
     
     # Check if form exists
     if form_name not in orders_data:
@@ -791,90 +1781,63 @@ def move_order(order_id):
         return jsonify({"success": False, "error": "target_form parameter is required"}), 400
     
     target_form = data['target_form']
-    orders_data = read_orders()
+    if not isinstance(target_form, str) or target_form not in read_orders():
+        return jsonify({"success": False, "error": "Target form not found"}), 404
     
     # Find the original order
     form_name, idx, order = find_order(order_id)
     if not order:
         return jsonify({"success": False, "error": "Order not found"}), 404
     
-    # Check if target form exists
-    if target_form not in orders_data:
-        return jsonify({"success": False, "error": "Target form not found"}), 404
-    
-    # Get target form's products
-    forms_data = read_forms()
-    if target_form not in forms_data:
-        return jsonify({"success": False, "error": "Target form products not found"}), 404
-    
-    # Validate products exist in target form
-    target_products = forms_data[target_form]["products"]
-    target_product_names = [p["name"] for p in target_products]
-    
-    for product_name in order["selectedProducts"].keys():
-        if product_name not in target_product_names:
-            return jsonify({
-                "success": False,
-                "error": f"Product '{product_name}' not available in target form"
-            }), 400
-    
-    # Validate inventory in target form
-    try:
-        # Get products ordered in target form
-        target_orders = orders_data[target_form]["orders"]
-        target_products_ordered = {}
-        for o in target_orders:
-            for p_name, p_data in o["selectedProducts"].items():
-                if p_name not in target_products_ordered:
-                    target_products_ordered[p_name] = 0
-                for extra, amount in p_data["extras"].items():
-                    target_products_ordered[p_name] += amount
+    # Lock both forms so the inventory check and the move are atomic
+    with store.transaction(form_name, target_form):
+        current_form, idx, order = find_order(order_id)
+        if current_form != form_name:
+            return jsonify({"success": False, "error": "Order was changed concurrently, please retry"}), 409
+
+        # Check if target form exists
+        if target_form not in read_orders():
+            return jsonify({"success": False, "error": "Target form not found"}), 404
         
-        # Check against target form inventory
-        for p_name, p_data in order["selectedProducts"].items():
-            # Find product in target form
-            target_product = next((p for p in target_products if p["name"] == p_name), None)
-            if not target_product:
-                continue
-            
-            # Calculate total ordered amount
-            ordered_amount = sum(p_data["extras"].values())
-            
-            # Get available inventory
-            available = target_product["inventory"]
-            already_ordered = target_products_ordered.get(p_name, 0)
-            remaining = available - already_ordered
-            
-            if ordered_amount > remaining:
+        # Get target form's products
+        forms_data = read_forms()
+        if target_form not in forms_data:
+            return jsonify({"success": False, "error": "Target form products not found"}), 404
+        
+        # Validate products exist in target form
+        target_product_names = [p["name"] for p in form_products(forms_data, target_form)]
+        
+        for product_name in order["selectedProducts"].keys():
+            if product_name not in target_product_names:
                 return jsonify({
                     "success": False,
-                    "error": f"Not enough inventory for '{p_name}' in target form (only {remaining} available)"
+                    "error": f"Product '{product_name}' not available in target form"
                 }), 400
-    except Exception as e:
-        return jsonify({
-            "success": False,
-            "error": f"Inventory validation failed: {str(e)}"
-        }), 500
-    
-    # Create a copy of the order for the target form
-    new_order = copy.deepcopy(order)
-    new_order["date"] = target_form
-    new_order["timestamp"] = datetime.now().isoformat()
-    
-    # Add to target form
-    orders_data[target_form]["orders"].append(new_order)
-    
-    # Update aggregates for target form
-    recalc_aggregates(orders_data, target_form)
-    
-    # Remove from original form
-    del orders_data[form_name]["orders"][idx]
-    
-    # Update aggregates for original form
-    recalc_aggregates(orders_data, form_name)
-    
-    # Save changes
-    write_orders(orders_data)
+        
+        # Validate inventory in target form (an order moved within its own
+        # form already holds its quantities)
+        previous = order["selectedProducts"] if target_form == form_name else None
+        shortage = inventory_shortage(target_form, order["selectedProducts"], previous)
+        if shortage:
+            p_name, remaining = shortage
+            return jsonify({
+                "success": False,
+                "error": f"Not enough inventory for '{p_name}' in target form (only {remaining} available)"
+            }), 400
+        
+        # Create a copy of the order for the target form
+        new_order = copy.deepcopy(order)
+        new_order["date"] = target_form
+        new_order["timestamp"] = datetime.now().isoformat()
+        
+        # Add to target form, remove from original form and update both aggregates
+        commit_orders({
+            "op": "move",
+            "form": form_name,
+            "id": order_id,
+            "target": target_form,
+            "order": new_order
+        })
     
     return jsonify({
         "success": True,
@@ -883,5 +1846,193 @@ def move_order(order_id):
     })
 
 
+BATCH_OPERATIONS = ('create', 'update', 'delete', 'move')
+BATCH_MAX_OPERATIONS = 500
+
+class OrderBatch:
+    """What a batch's earlier operations did, for validating the later ones.
+
+    Nothing is applied until the whole batch is planned: ``orders`` overlays
+    the store's orders by id ((None, None) once deleted) and ``reserved``
+    holds the stock each form gains or loses, per product.
+    """
+
+    def __init__(self):
+        self.orders = {}
+        self.reserved = {}
+        self.ops = []
+
+    def find(self, order_id):
+        if order_id in self.orders:
+            return self.orders[order_id]
+        form_name, _, order = find_order(order_id)
+        return form_name, order
+
+    def reserve(self, form_name, selected_products, sign=1):
+        form_reserved = self.reserved.setdefault(form_name, {})
+        for product_name, product in selected_products.items():
+            form_reserved[product_name] = (form_reserved.get(product_name, 0)
+                                           + sign * sum(product["extras"].values()))
+
+    def shortage(self, form_name, selected_products, previous_products=None):
+        return inventory_shortage(form_name, selected_products, previous_products,
+                                  self.reserved.get(form_name))
+
+def batch_failure(error, status):
+    return {"success": False, "error": error, "status": status}
+
+def plan_batch_operation(batch, operation, locked):
+    """Validate one batch operation the way its single-order route does.
+
+    Returns the operation's result; valid operations are recorded in
+    ``batch.ops``.
+    """
+    kind = operation.get("op") if isinstance(operation, dict) else None
+    if kind not in BATCH_OPERATIONS:
+        return batch_failure(f"op must be one of {', '.join(BATCH_OPERATIONS)}", 400)
+
+    if kind == "create":
+        try:
+            form_name, order = import_entry({**operation, "id": None}, None)
+        except ValueError as e:
+            return batch_failure(str(e), 400)
+        if form_name not in locked or form_name not in read_orders():
+            return batch_failure("Form not found", 404)
+        shortage = batch.shortage(form_name, order["selectedProducts"])
+        if shortage:
+            return batch_failure(f"Not enough inventory for '{shortage[0]}' (only {shortage[1]} available)", 409)
+        order["id"] = store.new_order_id()
+        batch.reserve(form_name, order["selectedProducts"])
+        batch.orders[order["id"]] = (form_name, order)
+        op = {"op": "create", "form": form_name, "order": order}
+        batch.ops.append(op)
+        return {"success": True, "order": order}
+
+    order_id = str(operation.get("id", ""))
+    form_name, order = batch.find(order_id)
+    if not order:
+        return batch_failure("Order not found", 404)
+    if form_name not in locked:
+        return batch_failure("Order was changed concurrently, please retry", 409)
+
+    if kind == "update":
+        try:
+            selected_prods = (clean_selected_products(operation["selectedProducts"])
+                              if "selectedProducts" in operation else order["selectedProducts"])
+        except ValueError as e:
+            return batch_failure(str(e), 400)
+        updated_order = {
+            **order,
+            "phone": operation.get("phone", order["phone"]),
+            "comment": operation.get("comment", order["comment"]),
+            "selectedProducts": selected_prods,
+            "totalAmount": operation.get("totalAmount", order["totalAmount"])
+        }
+        shortage = batch.shortage(form_name, updated_order["selectedProducts"], order["selectedProducts"])
+        if shortage:
+            return batch_failure(f"Not enough inventory for '{shortage[0]}' (only {shortage[1]} available)", 409)
+        batch.reserve(form_name, order["selectedProducts"], -1)
+        batch.reserve(form_name, updated_order["selectedProducts"])
+        batch.orders[order_id] = (form_name, updated_order)
+        op = {"op": "update", "form": form_name, "id": order_id, "order": updated_order}
+        batch.ops.append(op)
+        return {"success": True, "order": updated_order}
+
+    if kind == "delete":
+        batch.reserve(form_name, order["selectedProducts"], -1)
+        batch.orders[order_id] = (None, None)
+        op = {"op": "delete", "form": form_name, "id": order_id}
+        batch.ops.append(op)
+        return {"success": True, "id": order_id}
+
+    target_form = operation.get("target_form")
+    if not target_form:
+        return batch_failure("target_form parameter is required", 400)
+    if not isinstance(target_form, str):
+        return batch_failure("target_form must be a form name", 400)
+    forms_data = read_forms()
+    if target_form not in locked or target_form not in read_orders() or target_form not in forms_data:
+        return batch_failure("Target form not found", 404)
+    target_product_names = [p["name"] for p in form_products(forms_data, target_form)]
+    for product_name in order["selectedProducts"]:
+        if product_name not in target_product_names:
+            return batch_failure(f"Product '{product_name}' not available in target form", 400)
+    previous = order["selectedProducts"] if target_form == form_name else None
+    shortage = batch.shortage(target_form, order["selectedProducts"], previous)
+    if shortage:
+        return batch_failure(
+            f"Not enough inventory for '{shortage[0]}' in target form (only {shortage[1]} available)", 400)
+    new_order = copy.deepcopy(order)
+    new_order["date"] = target_form
+    new_order["timestamp"] = datetime.now().isoformat()
+    batch.reserve(form_name, order["selectedProducts"], -1)
+    batch.reserve(target_form, new_order["selectedProducts"])
+    batch.orders[order_id] = (target_form, new_order)
+    op = {"op": "move", "form": form_name, "id": order_id, "target": target_form, "order": new_order}
+    batch.ops.append(op)
+    return {"success": True, "order": new_order}
+
+@app.route('/api/orders/batch', methods=['POST'])
+def batch_orders():
+    """Apply a list of create/update/delete/move operations with one commit.
+
+    Body: {"operations": [{"op": "update", "id": ..., <fields>}, ...],
+    "atomic": false}. Operations are validated in order, each seeing the
+    effect of the ones before it, under the locks of every form involved.
+    The valid ones are then committed as a single batch (one write, one
+    aggregate update per form); with "atomic" any failure commits nothing.
+    Each operation gets a result with its own success flag and error.
+    """
+    data = request.json or {}
+    operations = data.get("operations")
+    if not isinstance(operations, list) or not operations:
+        return jsonify({
+            "success": False,
+            "error": "operations must be a non-empty list"
+        }), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({
+            "success": False,
+            "error": f"At most {BATCH_MAX_OPERATIONS} operations per batch"
+        }), 400
+
+    # Lock every form an operation names or an order currently lives in
+    form_names = set()
+    for operation in operations:
+        if not isinstance(operation, dict):
+            continue
+        form_names.update(str(operation[key]) for key in ("date", "form", "target_form") if operation.get(key))
+        if operation.get("id"):
+            found_form = find_order(str(operation["id"]))[0]
+            if found_form is not None:
+                form_names.add(found_form)
+
+    batch = OrderBatch()
+    with store.transaction(*form_names):
+        results = []
+        for index_in_batch, operation in enumerate(operations):
+            result = plan_batch_operation(batch, operation, form_names)
+            results.append({"index": index_in_batch, "op": operation.get("op") if isinstance(operation, dict) else None,
+                            **result})
+        failed = sum(1 for result in results if not result["success"])
+        if failed and data.get("atomic"):
+            for result in results:
+                if result["success"]:
+                    result.update({"success": False, "error": "Not applied: the batch is atomic"})
+            return jsonify({
+                "success": False,
+                "error": f"{failed} operations failed, nothing was applied",
+                "results": results
+            }), 409
+        if batch.ops:
+            commit_orders({"op": "batch", "ops": batch.ops})
+
+    return jsonify({
+        "success": not failed,
+        "applied": len(batch.ops),
+        "results": results
+    })
+
+
 if __name__ == '__main__':
     app.run(port=5000, host="0.0.0.0")
\ No newline at end of file
@@ -0,0 +1,118 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Process-local metrics rendered in the Prometheus text exposition format.
+# With several workers (MULTI_PROCESS=1) every process keeps its own numbers,
+# so a scrape reflects the worker that answered it.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, [("le", bound)])} {count}')
+                count = series[len(self.buckets)]
+                lines.append(f'{self.name}_bucket{_labels(self.labels, label_values, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {series[-1]}')
+                lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {count}')
+        return lines
+
+
+@contextmanager
+def timed(histogram, *label_values):
+    """Observe the wall time of a block in seconds"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, *label_values)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_SECONDS = Histogram(
+    'bakery_request_duration_seconds', 'Request latency by route.',
+    ('method', 'route', 'status'))
+REQUEST_BYTES = Histogram(
+    'bakery_request_size_bytes', 'Request body size by route.',
+    ('method', 'route'), SIZE_BUCKETS)
+RESPONSE_BYTES = Histogram(
+    'bakery_response_size_bytes', 'Response body size by route (streamed bodies count as 0).',
+    ('method', 'route'), SIZE_BUCKETS)
+# phase: read/parse when loading, serialize/write when saving
+STORAGE_SECONDS = Histogram(
+    'bakery_storage_duration_seconds', 'Time spent loading and saving the forms/orders documents.',
+    ('document', 'phase'))
+WRITE_BYTES = Histogram(
+    'bakery_storage_write_bytes', 'Bytes written to storage per save (JSON backend).',
+    ('document',), SIZE_BUCKETS)
+RELOADS = Counter(
+    'bakery_store_reloads_total', 'Documents re-read from storage because they changed.',
+    ('document',))
@@ -0,0 +1,72 @@
+# Production plan of a form: the ordered units of each product multiplied
+# by its recipe, the same arithmetic the orders summary page does by hand.
+#
+#   flour, water, salt, sourdough_*  grams per unit (x units)
+#   flours                           split of the flour by type, in percent;
+#                                    "substitute" percent points are taken
+#                                    from that type (replaced elsewhere)
+#
+# Recipes come from generic_products (set by update_sourdough_amounts);
+# products missing there fall back to the recipe fields on the form.
+
+from catalog import catalog_products
+
+STARTERS = (("white", "sourdough_white"), ("half_half", "sourdough_half_half"), ("black", "sourdough_black"))
+
+
+def _empty_totals():
+    return {"units": 0, "dough": 0, "flour": 0, "flours": {}, "water": 0, "salt": 0,
+            "sourdough": {starter: 0 for starter, _ in STARTERS}}
+
+
+def _add(totals, amounts):
+    for key in ("units", "dough", "flour", "water", "salt"):
+        totals[key] += amounts[key]
+    for flour_name, grams in amounts["flours"].items():
+        totals["flours"][flour_name] = totals["flours"].get(flour_name, 0) + grams
+    for starter, grams in amounts["sourdough"].items():
+        totals["sourdough"][starter] += grams
+
+
+def _rounded(totals):
+    return {
+        key: ({name: round(grams, 2) for name, grams in value.items()} if isinstance(value, dict)
+              else round(value, 2))
+        for key, value in totals.items()
+    }
+
+
+def product_amounts(recipe, units):
+    """Ingredient grams for ``units`` units of one product"""
+    amounts = _empty_totals()
+    amounts["units"] = units
+    amounts["flour"] = (recipe.get("flour") or 0) * units
+    amounts["water"] = (recipe.get("water") or 0) * units
+    amounts["salt"] = (recipe.get("salt") or 0) * units
+    for flour in recipe.get("flours") or []:
+        share = (flour.get("percentage", 0) - (flour.get("substitute") or 0)) / 100
+        amounts["flours"][flour["name"]] = amounts["flours"].get(flour["name"], 0) + share * amounts["flour"]
+    for starter, field in STARTERS:
+        amounts["sourdough"][starter] = (recipe.get(field) or 0) * units
+    amounts["dough"] = (amounts["flour"] + amounts["water"] + amounts["salt"]
+                        + sum(amounts["sourdough"].values()))
+    return amounts
+
+
+def production_plan(forms_data, form_name, form_orders):
+    """Per-product and total ingredient amounts for a form's ordered units"""
+    catalog = catalog_products(forms_data)
+    form = forms_data.get(form_name)
+    listed = form.get("products", []) if isinstance(form, dict) else form or []
+    on_form = {p["name"]: p for p in listed if isinstance(p, dict) and "name" in p}
+    products = {}
+    totals = _empty_totals()
+    for product_name, aggregate in form_orders.get("products", {}).items():
+        units = aggregate.get("total_amount", 0)
+        if not units:
+            continue
+        recipe = catalog.get(product_name) or on_form.get(product_name) or {}
+        amounts = product_amounts(recipe, units)
+        products[product_name] = _rounded(amounts)
+        _add(totals, amounts)
+    return {"products": products, "totals": _rounded(totals)}
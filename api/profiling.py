@@ -0,0 +1,121 @@
+import cProfile
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack every ``interval`` seconds.
+
+    Stacks are counted in the collapsed format used by flamegraph.pl and
+    speedscope: ``outer;inner;leaf count`` per line.
+    """
+
+    def __init__(self, thread_id, interval=0.001):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+            if self._stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """Profile selected Flask endpoints and dump one file per profiled request.
+
+    A request is profiled when its endpoint is in ``routes`` and it is the
+    ``sample_every``-th such request, or when it carries the header
+    ``X-Profile: <token>`` (any endpoint). ``mode`` is 'cprofile' (.pstats,
+    open with snakeviz or pstats) or 'sample' (.collapsed stacks for
+    flamegraphs; fast requests only get a few samples). Only one request
+    is profiled at a time; the newest ``keep`` files in ``directory`` are
+    kept.
+    """
+
+    def __init__(self, directory, routes=(), sample_every=0, token='', mode='cprofile',
+                 keep=50, data_size=None):
+        self.directory = directory
+        self.routes = set(routes)
+        self.sample_every = sample_every
+        self.token = token
+        self.mode = mode
+        self.keep = keep
+        self.data_size = data_size or (lambda: 0)
+        self._requests = itertools.count(1)
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.sample_every or self.token)
+
+    def _wanted(self, request):
+        if self.token and request.headers.get('X-Profile') == self.token:
+            return True
+        if self.sample_every and request.endpoint in self.routes:
+            return next(self._requests) % self.sample_every == 0
+        return False
+
+    def start(self, request):
+        """Begin profiling this request if it is selected; returns a handle or None"""
+        if not self._wanted(request) or not self._busy.acquire(blocking=False):
+            return None
+        if self.mode == 'sample':
+            profiler = StackSampler(threading.get_ident())
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return profiler, time.perf_counter()
+
+    def finish(self, handle, endpoint):
+        profiler, started = handle
+        try:
+            if isinstance(profiler, StackSampler):
+                profiler.stop()
+            else:
+                profiler.disable()
+            elapsed_ms = int((time.perf_counter() - started) * 1000)
+            os.makedirs(self.directory, exist_ok=True)
+            extension = 'collapsed' if isinstance(profiler, StackSampler) else 'pstats'
+            now = time.time()
+            filename = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now % 1 * 1000000):06d}"
+                        f"-{endpoint}-orders{self.data_size()}-{elapsed_ms}ms.{extension}")
+            path = os.path.join(self.directory, filename)
+            if isinstance(profiler, StackSampler):
+                profiler.dump(path)
+            else:
+                profiler.dump_stats(path)
+            self._rotate()
+        finally:
+            self._busy.release()
+
+    def _rotate(self):
+        dumps = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime)
+        for entry in dumps[:-self.keep] if self.keep else []:
+            os.remove(entry.path)
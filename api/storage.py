@@ -0,0 +1,614 @@
+import copy
+import functools
+import hashlib
+import json
+import os
+import re
+import secrets
+import sqlite3
+import tempfile
+
+from metrics import STORAGE_SECONDS, WRITE_BYTES, timed
+from store import OrderIndex, apply_order_op, op_forms
+
+
+# Storage backends used by DataStore. All expose the same interface:
+#
+#   signature(name)            cheap token that changes when 'forms' or
+#                              'orders' changed in storage
+#   load_forms() / load_orders()
+#   save_forms(forms)          persist the whole forms document
+#   save_order_op(orders, op)  persist one order mutation, or a "batch" of
+#                              them in one write; ``orders`` is the
+#                              document with ``op`` already applied
+#   save_orders(orders)        replace all orders (migration/repair)
+#   compact(orders)            fold pending records into the snapshot
+
+
+class JsonStorage:
+    """The original forms.json / orders.json files.
+
+    In ``journal`` mode each order mutation is appended to
+    ``<orders_file>.journal`` as one compact line and fsynced instead of
+    rewriting the orders file. After ``compact_every`` records the journal is
+    folded into the orders file. Loading always replays the orders file plus
+    whatever journal tail exists.
+    """
+
+    def __init__(self, forms_file, orders_file, default_forms,
+                 journal=False, compact_every=500):
+        self.forms_file = forms_file
+        self.orders_file = orders_file
+        self.default_forms = default_forms
+        self.journal = journal
+        self.journal_file = orders_file + '.journal'
+        self.compact_every = compact_every
+        self._journal_records = 0
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def signature(self, name):
+        if name == 'orders':
+            return (self._stat(self.orders_file), self._stat(self.journal_file))
+        return self._stat(self.forms_file)
+
+    @staticmethod
+    def _write_json(path, data, document):
+        with timed(STORAGE_SECONDS, document, 'serialize'):
+            body = json.dumps(data, indent=2).encode('utf-8')
+        # Write a private temp file and rename it over the target, so readers
+        # (including other workers) see either the old or the new document
+        with timed(STORAGE_SECONDS, document, 'write'):
+            directory, filename = os.path.split(os.path.abspath(path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=filename + '.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(body)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        WRITE_BYTES.observe(len(body), document)
+
+    @staticmethod
+    def _read_json(path, document):
+        with timed(STORAGE_SECONDS, document, 'read'):
+            with open(path, 'rb') as f:
+                body = f.read()
+        with timed(STORAGE_SECONDS, document, 'parse'):
+            return json.loads(body)
+
+    def load_forms(self):
+        if not os.path.exists(self.forms_file):
+            # If file doesn't exist, create it with default data
+            forms_data = copy.deepcopy(self.default_forms)
+            self._write_json(self.forms_file, forms_data, 'forms')
+            return forms_data
+        try:
+            return self._read_json(self.forms_file, 'forms')
+        except json.JSONDecodeError:
+            # If file is corrupted, serve default data
+            return copy.deepcopy(self.default_forms)
+
+    def save_forms(self, forms_data):
+        self._write_json(self.forms_file, forms_data, 'forms')
+
+    def load_orders(self):
+        orders = self._read_json(self.orders_file, 'orders')
+        with timed(STORAGE_SECONDS, 'journal', 'parse'):
+            self._journal_records = self._replay_journal(orders)
+        if self._journal_records and not self.journal:
+            # Journal left over from journal mode: fold it in right away
+            self.compact(orders)
+        return orders
+
+    def _replay_journal(self, orders):
+        if not os.path.exists(self.journal_file):
+            return 0
+        records = 0
+        index = OrderIndex(orders)
+        with open(self.journal_file, 'r+b') as f:
+            end = 0
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("unterminated record")
+                    op = json.loads(line)
+                except ValueError:
+                    # Torn final record from a crash mid-append: cut it off,
+                    # or the next append would be glued onto the fragment
+                    f.truncate(end)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    break
+                apply_order_op(orders, op, index)
+                records += 1
+                end += len(line)
+        return records
+
+    def _append_journal(self, op):
+        with timed(STORAGE_SECONDS, 'journal', 'serialize'):
+            line = (json.dumps(op, separators=(',', ':'), ensure_ascii=False) + '\n').encode('utf-8')
+        with timed(STORAGE_SECONDS, 'journal', 'write'):
+            with open(self.journal_file, 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        WRITE_BYTES.observe(len(line), 'journal')
+        self._journal_records += 1
+
+    def save_order_op(self, orders, op):
+        if not self.journal:
+            self._write_json(self.orders_file, orders, 'orders')
+            return
+        self._append_journal(op)
+        if self._journal_records >= self.compact_every:
+            self.compact(orders)
+
+    def save_orders(self, orders):
+        self.compact(orders)
+
+    def compact(self, orders):
+        """Write the orders snapshot and drop the journal it now contains"""
+        self._write_json(self.orders_file, orders, 'orders')
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+        self._journal_records = 0
+
+
+class ShardedJsonStorage(JsonStorage):
+    """forms.json plus one orders file per form under ``orders_dir``.
+
+    ``manifest.json`` lists the forms in document order with their file
+    names; each shard holds that form's {"orders": [...], "products": {...}}.
+    An order mutation rewrites only the shards of the forms it touches (and
+    the manifest when forms are added or dropped), then replaces the random
+    token in ``generation``. Checking freshness reads just that token, so it
+    costs the same however many forms there are; after editing shards by
+    hand, delete ``generation`` and the next read reloads, re-reading only
+    the shards whose files changed.
+
+    A move writes the target shard before the source, so a crash in
+    between leaves the order in both forms rather than in neither.
+
+    Without a manifest the orders start empty, unless ``legacy_orders_file``
+    (orders.json) still holds orders: then loading fails until they were
+    split with migrate_json_to_sharded, rather than serving no orders.
+    """
+
+    MANIFEST = 'manifest.json'
+    GENERATION = 'generation'
+
+    def __init__(self, forms_file, orders_dir, default_forms, legacy_orders_file=None):
+        super().__init__(forms_file, os.path.join(orders_dir, self.MANIFEST), default_forms)
+        self.legacy_orders_file = legacy_orders_file
+        self.orders_dir = orders_dir
+        self.manifest_file = self.orders_file
+        self.generation_file = os.path.join(orders_dir, self.GENERATION)
+        self._files = {}
+        # shard file -> (stat signature, loaded form document)
+        self._shards = {}
+
+    @staticmethod
+    def shard_filename(form_name):
+        """Readable, collision-free file name for a form"""
+        slug = re.sub(r'[^A-Za-z0-9_-]+', '_', form_name).strip('_')[:40] or 'form'
+        digest = hashlib.sha1(form_name.encode('utf-8')).hexdigest()[:8]
+        return f"{slug}-{digest}.json"
+
+    def _shard_path(self, filename):
+        return os.path.join(self.orders_dir, filename)
+
+    def signature(self, name):
+        if name != 'orders':
+            return super().signature(name)
+        try:
+            with open(self.generation_file) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _bump_generation(self):
+        # Not fsynced: after a crash every worker starts with a fresh load
+        with open(self.generation_file, 'w') as f:
+            f.write(secrets.token_hex(8))
+
+    def load_orders(self):
+        if not os.path.exists(self.manifest_file):
+            if self._legacy_orders_pending():
+                raise RuntimeError(f"{self.legacy_orders_file} holds orders but {self.orders_dir}/ has none; "
+                                   "run 'flask migrate-sharded' first")
+            self._write_manifest({})
+            self._bump_generation()
+        manifest = self._read_json(self.manifest_file, 'orders')
+        files = {entry["name"]: entry["file"] for entry in manifest["forms"]}
+        orders, shards = {}, {}
+        for form_name, filename in files.items():
+            path = self._shard_path(filename)
+            stat = self._stat(path)
+            cached = self._shards.get(filename)
+            if cached is not None and cached[0] == stat:
+                form = cached[1]
+            else:
+                form = self._read_json(path, 'orders')
+            orders[form_name] = form
+            shards[filename] = (stat, form)
+        self._files, self._shards = files, shards
+        return orders
+
+    def _legacy_orders_pending(self):
+        if self.legacy_orders_file is None:
+            return False
+        if os.path.exists(self.legacy_orders_file + '.journal'):
+            return True
+        try:
+            return bool(self._read_json(self.legacy_orders_file, 'orders'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+
+    def _write_manifest(self, files):
+        manifest = {"forms": [{"name": name, "file": filename} for name, filename in files.items()]}
+        os.makedirs(self.orders_dir, exist_ok=True)
+        self._write_json(self.manifest_file, manifest, 'orders')
+
+    def _write_shard(self, orders, form_name):
+        filename = self._files.get(form_name) or self.shard_filename(form_name)
+        path = self._shard_path(filename)
+        self._write_json(path, orders[form_name], 'orders')
+        self._shards[filename] = (self._stat(path), orders[form_name])
+        return filename
+
+    def _remove_shard(self, form_name):
+        filename = self._files.pop(form_name, None)
+        if filename is not None:
+            self._shards.pop(filename, None)
+            if os.path.exists(self._shard_path(filename)):
+                os.remove(self._shard_path(filename))
+
+    def save_order_op(self, orders, op):
+        try:
+            self._save_shards(orders, op)
+        except BaseException:
+            # The cached shards are the in-memory documents, which already
+            # hold the op: re-read the touched ones from disk next time
+            for form_name in op_forms(op):
+                self._shards.pop(self._files.get(form_name), None)
+            raise
+        finally:
+            self._bump_generation()
+
+    def _save_shards(self, orders, op):
+        kind = op["op"]
+        if kind == "add_form":
+            filename = self._write_shard(orders, op["form"])
+            self._files[op["form"]] = filename
+            self._write_manifest(self._files)
+        elif kind == "drop_form":
+            files = dict(self._files)
+            files.pop(op["form"], None)
+            self._write_manifest(files)
+            self._remove_shard(op["form"])
+        elif kind == "move":
+            self._write_shard(orders, op["target"])
+            self._write_shard(orders, op["form"])
+        elif kind == "batch":
+            # Forms receiving moved orders first, as for a single move
+            targets = {sub_op["target"] for sub_op in op["ops"] if sub_op["op"] == "move"}
+            for form_name in sorted(op_forms(op), key=lambda name: name not in targets):
+                self._write_shard(orders, form_name)
+        else:
+            self._write_shard(orders, op["form"])
+
+    def save_orders(self, orders):
+        os.makedirs(self.orders_dir, exist_ok=True)
+        stale = set(self._files.values())
+        files = {}
+        for form_name in orders:
+            files[form_name] = self._files.get(form_name) or self.shard_filename(form_name)
+            self._files[form_name] = files[form_name]
+            self._write_shard(orders, form_name)
+        self._write_manifest(files)
+        for filename in stale - set(files.values()):
+            self._shards.pop(filename, None)
+            if os.path.exists(self._shard_path(filename)):
+                os.remove(self._shard_path(filename))
+        self._files = files
+        self._bump_generation()
+
+    def compact(self, orders):
+        # Every mutation is already written to its shard
+        pass
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS forms (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    layout INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    form_name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT,
+    body TEXT NOT NULL,
+    PRIMARY KEY (form_name, position)
+);
+CREATE INDEX IF NOT EXISTS products_by_name ON products (form_name, name);
+CREATE TABLE IF NOT EXISTS order_forms (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id TEXT PRIMARY KEY,
+    form_name TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT,
+    phone TEXT,
+    timestamp TEXT,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS orders_by_form ON orders (form_name, seq);
+CREATE INDEX IF NOT EXISTS orders_by_phone ON orders (phone);
+CREATE TABLE IF NOT EXISTS aggregates (
+    form_name TEXT NOT NULL,
+    product TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    total_amount INTEGER NOT NULL,
+    extras TEXT NOT NULL,
+    PRIMARY KEY (form_name, product)
+);
+"""
+
+# forms.layout: how a form entry is shaped in the forms document
+FORM_WITH_PRODUCTS = 1  # {"products": [...], "metadata": ..., ...}
+FORM_LIST = 2           # old format: the entry is the bare product list
+FORM_OTHER = 0          # a dict without a products list
+
+
+def _timed(document, phase):
+    """Time a whole SqliteStorage call (queries and JSON decoding together)"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            with timed(STORAGE_SECONDS, document, phase):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class SqliteStorage:
+    """SQLite database in WAL mode with one row per form, product and order.
+
+    Order mutations only touch the affected order rows and the per-product
+    aggregate rows of the affected forms, inside one transaction. Forms are
+    diffed against the last saved copy so only changed forms are rewritten.
+    """
+
+    def __init__(self, db_file, default_forms):
+        self.db_file = db_file
+        self.default_forms = default_forms
+        self.conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self._saved_forms = {}
+
+    def signature(self, name):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _bump(self, name):
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1", (name,))
+
+    def _transaction(self):
+        return _Transaction(self.conn)
+
+    # Forms
+
+    @_timed('forms', 'read')
+    def load_forms(self):
+        form_rows = self.conn.execute(
+            "SELECT name, layout, body FROM forms ORDER BY position").fetchall()
+        if not form_rows:
+            return copy.deepcopy(self.default_forms)
+        products = {}
+        for form_name, body in self.conn.execute(
+                "SELECT form_name, body FROM products ORDER BY form_name, position"):
+            products.setdefault(form_name, []).append(json.loads(body))
+
+        forms_data = {}
+        for name, layout, body in form_rows:
+            if layout == FORM_LIST:
+                forms_data[name] = products.get(name, [])
+            else:
+                form = json.loads(body)
+                if layout == FORM_WITH_PRODUCTS:
+                    form = {"products": products.get(name, []), **form}
+                forms_data[name] = form
+        self._saved_forms = {name: _dumps(form) for name, form in forms_data.items()}
+        return forms_data
+
+    @_timed('forms', 'write')
+    def save_forms(self, forms_data):
+        serialized = {name: _dumps(form) for name, form in forms_data.items()}
+        reordered = list(serialized) != list(self._saved_forms)
+        with self._transaction():
+            for name in self._saved_forms:
+                if name not in serialized:
+                    self.conn.execute("DELETE FROM forms WHERE name = ?", (name,))
+                    self.conn.execute("DELETE FROM products WHERE form_name = ?", (name,))
+            for position, (name, text) in enumerate(serialized.items()):
+                if self._saved_forms.get(name) == text:
+                    if reordered:
+                        self.conn.execute("UPDATE forms SET position = ? WHERE name = ?",
+                                          (position, name))
+                    continue
+                self._write_form(name, position, forms_data[name])
+            self._bump('forms')
+        self._saved_forms = serialized
+
+    def _write_form(self, name, position, form):
+        if isinstance(form, list):
+            layout, body, products = FORM_LIST, {}, form
+        elif isinstance(form, dict) and isinstance(form.get("products"), list):
+            layout, products = FORM_WITH_PRODUCTS, form["products"]
+            body = {k: v for k, v in form.items() if k != "products"}
+        else:
+            layout, body, products = FORM_OTHER, form, []
+        self.conn.execute(
+            "INSERT OR REPLACE INTO forms (name, position, layout, body) VALUES (?, ?, ?, ?)",
+            (name, position, layout, _dumps(body)))
+        self.conn.execute("DELETE FROM products WHERE form_name = ?", (name,))
+        self.conn.executemany(
+            "INSERT INTO products (form_name, position, name, body) VALUES (?, ?, ?, ?)",
+            [(name, i, (p.get("name") or p.get("ref")) if isinstance(p, dict) else None, _dumps(p))
+             for i, p in enumerate(products)])
+
+    # Orders
+
+    @_timed('orders', 'read')
+    def load_orders(self):
+        orders = {}
+        for (name,) in self.conn.execute("SELECT name FROM order_forms ORDER BY position"):
+            orders[name] = {"orders": [], "products": {}}
+        for form_name, body in self.conn.execute(
+                "SELECT form_name, body FROM orders ORDER BY form_name, seq"):
+            orders[form_name]["orders"].append(json.loads(body))
+        for form_name, product, total_amount, extras in self.conn.execute(
+                "SELECT form_name, product, total_amount, extras FROM aggregates "
+                "ORDER BY form_name, position"):
+            orders[form_name]["products"][product] = {
+                "total_amount": total_amount,
+                "extras": json.loads(extras)
+            }
+        return orders
+
+    def _insert_order(self, form_name, order):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO orders (id, form_name, seq, name, phone, timestamp, body) "
+            "VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM orders WHERE form_name = ?), "
+            "?, ?, ?, ?)",
+            (order["id"], form_name, form_name, order.get("name"), order.get("phone"),
+             order.get("timestamp"), _dumps(order)))
+
+    def _write_aggregates(self, orders, form_name):
+        self.conn.execute("DELETE FROM aggregates WHERE form_name = ?", (form_name,))
+        if form_name not in orders:
+            return
+        self.conn.executemany(
+            "INSERT INTO aggregates (form_name, product, position, total_amount, extras) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(form_name, product, i, agg["total_amount"], _dumps(agg["extras"]))
+             for i, (product, agg) in enumerate(orders[form_name]["products"].items())])
+
+    def _write_op_rows(self, op):
+        kind = op["op"]
+        if kind == "batch":
+            for sub_op in op["ops"]:
+                self._write_op_rows(sub_op)
+            return
+        form_name = op["form"]
+        if kind == "add_form":
+            self.conn.execute(
+                "INSERT OR REPLACE INTO order_forms (name, position) VALUES "
+                "(?, (SELECT COALESCE(MAX(position), 0) + 1 FROM order_forms))", (form_name,))
+            self.conn.execute("DELETE FROM orders WHERE form_name = ?", (form_name,))
+        elif kind == "drop_form":
+            self.conn.execute("DELETE FROM order_forms WHERE name = ?", (form_name,))
+            self.conn.execute("DELETE FROM orders WHERE form_name = ?", (form_name,))
+        elif kind == "create":
+            self._insert_order(form_name, op["order"])
+        elif kind == "update":
+            self.conn.execute(
+                "UPDATE orders SET name = ?, phone = ?, timestamp = ?, body = ? WHERE id = ?",
+                (op["order"].get("name"), op["order"].get("phone"),
+                 op["order"].get("timestamp"), _dumps(op["order"]), op["id"]))
+        elif kind == "delete":
+            self.conn.execute("DELETE FROM orders WHERE id = ?", (op["id"],))
+        elif kind == "move":
+            self.conn.execute("DELETE FROM orders WHERE id = ?", (op["id"],))
+            self._insert_order(op["target"], op["order"])
+
+    @_timed('orders', 'write')
+    def save_order_op(self, orders, op):
+        with self._transaction():
+            self._write_op_rows(op)
+            # Aggregates once per touched form, however many ops a batch has
+            for form_name in op_forms(op):
+                self._write_aggregates(orders, form_name)
+            self._bump('orders')
+
+    @_timed('orders', 'write')
+    def save_orders(self, orders):
+        with self._transaction():
+            self.conn.execute("DELETE FROM order_forms")
+            self.conn.execute("DELETE FROM orders")
+            self.conn.execute("DELETE FROM aggregates")
+            for position, (form_name, form_data) in enumerate(orders.items()):
+                self.conn.execute("INSERT INTO order_forms (name, position) VALUES (?, ?)",
+                                  (form_name, position))
+                self.conn.executemany(
+                    "INSERT INTO orders (id, form_name, seq, name, phone, timestamp, body) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(o["id"], form_name, seq, o.get("name"), o.get("phone"),
+                      o.get("timestamp"), _dumps(o))
+                     for seq, o in enumerate(form_data.get("orders", []))])
+                self._write_aggregates(orders, form_name)
+            self._bump('orders')
+
+    def compact(self, orders):
+        """Checkpoint the WAL into the main database file"""
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK on an autocommit connection"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def migrate_json_to_sharded(json_storage, sharded_storage):
+    """One-shot split of orders.json (plus journal) into per-form shard files"""
+    orders = json_storage.load_orders()
+    sharded_storage.save_orders(orders)
+    return orders
+
+
+def migrate_json_to_sqlite(json_storage, sqlite_storage):
+    """One-shot import of forms.json/orders.json (plus journal) into SQLite"""
+    forms_data = json_storage.load_forms()
+    orders = json_storage.load_orders()
+    sqlite_storage._saved_forms = {}
+    with sqlite_storage._transaction():
+        sqlite_storage.conn.execute("DELETE FROM forms")
+        sqlite_storage.conn.execute("DELETE FROM products")
+    sqlite_storage.save_forms(forms_data)
+    sqlite_storage.save_orders(orders)
+    return forms_data, orders
@@ -0,0 +1,780 @@
+import copy
+import fcntl
+import json
+import mmap
+import os
+import secrets
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import ExitStack, contextmanager, nullcontext
+from datetime import datetime
+
+from catalog import materialize_forms, normalize_forms
+from metrics import RELOADS
+from production import production_plan
+
+
+def find_position(form_data, order_id):
+    """Return the index of an order inside a form's order list, or None"""
+    for idx, order in enumerate(form_data["orders"]):
+        if order["id"] == order_id:
+            return idx
+    return None
+
+
+def add_order_to_aggregates(products_agg, order):
+    """Add one order's quantities to a form's "products" aggregates"""
+    for prod_name, product in order["selectedProducts"].items():
+        if prod_name not in products_agg:
+            products_agg[prod_name] = {"total_amount": 0, "extras": {}}
+        for extra_name, amount in product["extras"].items():
+            if extra_name not in products_agg[prod_name]["extras"]:
+                products_agg[prod_name]["extras"][extra_name] = {"amount": 0, "names": []}
+
+            products_agg[prod_name]["extras"][extra_name]["amount"] += amount
+            products_agg[prod_name]["extras"][extra_name]["names"].append(order["name"])
+            products_agg[prod_name]["total_amount"] += amount
+
+
+def remove_order_from_aggregates(products_agg, order):
+    """Subtract one order's quantities from a form's "products" aggregates"""
+    for prod_name, product in order["selectedProducts"].items():
+        prod_agg = products_agg.get(prod_name)
+        if prod_agg is None:
+            continue
+        for extra_name, amount in product["extras"].items():
+            extra_agg = prod_agg["extras"].get(extra_name)
+            if extra_agg is None:
+                continue
+            extra_agg["amount"] -= amount
+            if order["name"] in extra_agg["names"]:
+                extra_agg["names"].remove(order["name"])
+            prod_agg["total_amount"] -= amount
+            if extra_agg["amount"] == 0 and not extra_agg["names"]:
+                del prod_agg["extras"][extra_name]
+        if prod_agg["total_amount"] == 0 and not prod_agg["extras"]:
+            del products_agg[prod_name]
+
+
+# Full rebuild of a form's aggregates, used for repair
+def recalc_aggregates(orders_data, form_name):
+    products_agg = {}
+    for order in orders_data[form_name]["orders"]:
+        add_order_to_aggregates(products_agg, order)
+    orders_data[form_name]["products"] = products_agg
+
+
+class OrderIndex:
+    """Maps order id -> (form name, position in that form's order list).
+
+    Kept in step with the orders document by apply_order_op so lookups by
+    id never have to scan the forms.
+    """
+
+    def __init__(self, orders=None):
+        self.positions = {}
+        if orders is not None:
+            self.rebuild(orders)
+
+    def rebuild(self, orders):
+        self.positions = {}
+        for form_name, form_data in orders.items():
+            self._index_from(form_name, form_data["orders"], 0)
+
+    def _index_from(self, form_name, form_orders, start):
+        for idx in range(start, len(form_orders)):
+            self.positions[form_orders[idx]["id"]] = (form_name, idx)
+
+    def lookup(self, order_id):
+        """Return (form name, position) or (None, None)"""
+        return self.positions.get(order_id, (None, None))
+
+    def position(self, form_name, order_id):
+        found_form, idx = self.lookup(order_id)
+        return idx if found_form == form_name else None
+
+    def appended(self, form_name, form_orders):
+        self.positions[form_orders[-1]["id"]] = (form_name, len(form_orders) - 1)
+
+    def removed(self, form_name, form_orders, idx, order_id):
+        # Orders after the removed one shift down by one
+        del self.positions[order_id]
+        self._index_from(form_name, form_orders, idx)
+
+    def forget_form(self, form_data):
+        for order in form_data["orders"]:
+            self.positions.pop(order["id"], None)
+
+
+def _position(orders, form_name, order_id, index):
+    if index is None:
+        return find_position(orders[form_name], order_id)
+    return index.position(form_name, order_id)
+
+
+def _append_order(orders, form_name, order, index):
+    orders[form_name]["orders"].append(order)
+    if index is not None:
+        index.appended(form_name, orders[form_name]["orders"])
+
+
+def _delete_order(orders, form_name, idx, order_id, index):
+    del orders[form_name]["orders"][idx]
+    if index is not None:
+        index.removed(form_name, orders[form_name]["orders"], idx, order_id)
+
+
+def apply_order_op(orders, op, index=None):
+    """Apply one order mutation record to the orders document.
+
+    Records are idempotent, so replaying a journal over a snapshot that
+    already contains some of them (a crash during compaction) is harmless.
+    Aggregates are adjusted by the old and new order's contribution only;
+    use recalc_aggregates for a full rebuild. Pass an OrderIndex to resolve
+    ids in constant time and keep it updated.
+
+    A "batch" record applies its "ops" in order; storage backends persist
+    it as one write.
+    """
+    kind = op["op"]
+    if kind == "batch":
+        for sub_op in op["ops"]:
+            apply_order_op(orders, sub_op, index)
+        return
+    form_name = op["form"]
+
+    if kind == "add_form":
+        if index is not None and form_name in orders:
+            index.forget_form(orders[form_name])
+        orders[form_name] = {"orders": [], "products": {}}
+    elif kind == "drop_form":
+        if index is not None and form_name in orders:
+            index.forget_form(orders[form_name])
+        orders.pop(form_name, None)
+    elif kind == "create":
+        if _position(orders, form_name, op["order"]["id"], index) is None:
+            _append_order(orders, form_name, op["order"], index)
+            add_order_to_aggregates(orders[form_name]["products"], op["order"])
+    elif kind == "update":
+        idx = _position(orders, form_name, op["id"], index)
+        if idx is not None:
+            products_agg = orders[form_name]["products"]
+            remove_order_from_aggregates(products_agg, orders[form_name]["orders"][idx])
+            orders[form_name]["orders"][idx] = op["order"]
+            add_order_to_aggregates(products_agg, op["order"])
+    elif kind == "delete":
+        idx = _position(orders, form_name, op["id"], index)
+        if idx is not None:
+            remove_order_from_aggregates(orders[form_name]["products"], orders[form_name]["orders"][idx])
+            _delete_order(orders, form_name, idx, op["id"], index)
+    elif kind == "move":
+        target = op["target"]
+        idx = _position(orders, form_name, op["id"], index)
+        if idx is not None:
+            remove_order_from_aggregates(orders[form_name]["products"], orders[form_name]["orders"][idx])
+            _delete_order(orders, form_name, idx, op["id"], index)
+        if _position(orders, target, op["id"], index) is None:
+            _append_order(orders, target, op["order"], index)
+            add_order_to_aggregates(orders[target]["products"], op["order"])
+    else:
+        raise ValueError(f"Unknown order operation: {kind}")
+
+
+class StockCounters:
+    """Ordered and remaining units per (form, product).
+
+    Ordered units mirror each form's aggregates and inventory comes from
+    the forms document (12 when unset, as in the route handlers). DataStore
+    rebuilds the counters lazily after a load or a forms write, and
+    refreshes only the forms touched by each order mutation.
+    """
+
+    def __init__(self):
+        self.valid = False
+        self._inventory = {}
+        self._ordered = {}
+
+    def rebuild(self, forms_data, orders):
+        self._inventory = {}
+        for form_name, form in forms_data.items():
+            products = form.get("products", []) if isinstance(form, dict) else form
+            self._inventory[form_name] = {p["name"]: p.get("inventory", 12) for p in products}
+        self._ordered = {}
+        for form_name in orders:
+            self.refresh(orders, form_name)
+        self.valid = True
+
+    def refresh(self, orders, form_name):
+        """Re-read one form's ordered units from its aggregates"""
+        if form_name in orders:
+            self._ordered[form_name] = {
+                name: agg["total_amount"] for name, agg in orders[form_name]["products"].items()
+            }
+        else:
+            self._ordered.pop(form_name, None)
+
+    def ordered(self, form_name):
+        return dict(self._ordered.get(form_name, {}))
+
+    def stock(self, form_name):
+        """Counters for the products listed in a form, or None for unknown forms"""
+        inventory = self._inventory.get(form_name)
+        if inventory is None:
+            return None
+        ordered = self._ordered.get(form_name, {})
+        stock = {}
+        for name, units in inventory.items():
+            total = ordered.get(name, 0)
+            stock[name] = {
+                "inventory": units,
+                "ordered": total,
+                "remaining": max(units - total, 0),
+                "soldOut": total >= units
+            }
+        return stock
+
+
+class ChangeFeed:
+    """Bounded log of data changes numbered with increasing sequence numbers.
+
+    Entries are kept serialized, so readers splice them straight into a
+    response. With a ``path`` (multi-process mode) every entry is also
+    appended to a log file shared by the workers, which each worker tails
+    before reading or recording; once the file holds twice ``retention``
+    entries it is rewritten with the newest ``retention``. Callers hold
+    DataStore.lock, plus the SharedState exclusive lock when recording.
+    """
+
+    def __init__(self, retention=1000, path=None):
+        self.retention = retention
+        self.path = path
+        self.seq = 0
+        self.entries = deque(maxlen=retention)
+        self._file_id = None
+        self._offset = 0
+        self._file_entries = 0
+
+    def sync(self):
+        """Pick up entries other workers appended to the shared log"""
+        if self.path is None:
+            return
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        if (st.st_dev, st.st_ino) != self._file_id:
+            # Rewritten by a compaction: re-read the (bounded) file
+            self._file_id = (st.st_dev, st.st_ino)
+            self._offset = 0
+            self._file_entries = 0
+            self.entries.clear()
+        if st.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                self._offset += len(line)
+                self._file_entries += 1
+                seq, text = line.decode('utf-8').rstrip('\n').split('\t', 1)
+                self.entries.append((int(seq), text))
+                self.seq = max(self.seq, int(seq))
+
+    def record(self, change):
+        self.sync()
+        self.seq += 1
+        text = json.dumps({"seq": self.seq, **change}, separators=(',', ':'), ensure_ascii=False)
+        self.entries.append((self.seq, text))
+        if self.path is not None:
+            line = f"{self.seq}\t{text}\n".encode('utf-8')
+            with open(self.path, 'ab') as f:
+                f.write(line)
+            st = os.stat(self.path)
+            self._file_id = (st.st_dev, st.st_ino)
+            self._offset += len(line)
+            self._file_entries += 1
+            if self._file_entries >= 2 * self.retention:
+                self._compact()
+        return self.seq
+
+    def _compact(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for seq, text in self.entries:
+                f.write(f"{seq}\t{text}\n".encode('utf-8'))
+        os.replace(tmp_path, self.path)
+        st = os.stat(self.path)
+        self._file_id = (st.st_dev, st.st_ino)
+        self._offset = st.st_size
+        self._file_entries = len(self.entries)
+
+    def since(self, seq):
+        """Serialized entries after ``seq``, or None if some of them were dropped"""
+        self.sync()
+        if seq > self.seq:
+            return None
+        if seq < self.seq and (not self.entries or self.entries[0][0] > seq + 1):
+            return None
+        return [text for entry_seq, text in self.entries if entry_seq > seq]
+
+
+def op_forms(op):
+    """Names of the forms an order op (or every op of a batch) touches"""
+    if op["op"] == "batch":
+        names = []
+        for sub_op in op["ops"]:
+            names += [name for name in op_forms(sub_op) if name not in names]
+        return names
+    return [op["form"]] + ([op["target"]] if op.get("target", op["form"]) != op["form"] else [])
+
+
+def order_change(orders, op):
+    """Change-feed entry for an order op, with the affected forms' aggregates"""
+    change = {"type": op["op"], "form": op["form"]}
+    if "order" in op:
+        change["id"] = op["order"]["id"]
+        change["order"] = op["order"]
+    elif "id" in op:
+        change["id"] = op["id"]
+    if "target" in op:
+        change["target"] = op["target"]
+    change["products"] = {name: orders[name]["products"] for name in op_forms(op) if name in orders}
+    return change
+
+
+class SharedState:
+    """Coordination between several worker processes sharing the data files.
+
+    The state file starts with one generation counter per document, mapped
+    into every worker with mmap. A worker bumps the counter after persisting
+    a change; readers compare it with the generation they loaded and reload
+    lazily when it moved. flock locks serialize mutations: the state file
+    itself guards saving (shared while loading), and every form hashes to
+    one of FORM_SLOTS lock files in ``<path>.slots`` used by
+    DataStore.transaction().
+
+    Each lock has its own file because fcntl record locks on one file belong
+    to the process: with several threads per worker the kernel's deadlock
+    detection then reports EDEADLK for waits that are not cycles at all.
+    flock does no such detection. Its locks belong to the open file, which
+    threads share, so each slot is paired with a thread lock, and the files
+    are reopened in a forked worker. The caller must hold DataStore.lock
+    around ``exclusive()`` and ``loading()``.
+    """
+
+    HEADER = struct.Struct('<QQQ')
+    OFFSETS = {'forms': 0, 'orders': 8}
+    EPOCH_OFFSET = 16
+    FORM_SLOTS = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.slot_dir = path + '.slots'
+        os.makedirs(self.slot_dir, exist_ok=True)
+        self._fds = {}
+        self._fds_pid = None
+        self._fds_guard = threading.Lock()
+        self.fd = self._lock_fd(None)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self.fd).st_size < self.HEADER.size:
+                os.ftruncate(self.fd, self.HEADER.size)
+            self.map = mmap.mmap(self.fd, self.HEADER.size)
+            if self.epoch() == 0:
+                # Random per state file, so version tokens never repeat after a reset
+                struct.pack_into('<Q', self.map, self.EPOCH_OFFSET, secrets.randbits(63) + 1)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self._depth = 0
+        self._slot_locks = [threading.Lock() for _ in range(self.FORM_SLOTS)]
+
+    def _lock_fd(self, slot):
+        """This process's descriptor of the save lock (None) or a slot's lock file"""
+        with self._fds_guard:
+            if self._fds_pid != os.getpid():
+                # A forked worker would share the parent's open files, and so its locks
+                for fd in self._fds.values():
+                    os.close(fd)
+                self._fds = {}
+                self._fds_pid = os.getpid()
+            if slot not in self._fds:
+                path = self.path if slot is None else os.path.join(self.slot_dir, f'{slot:02d}.lock')
+                self._fds[slot] = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            return self._fds[slot]
+
+    def epoch(self):
+        return struct.unpack_from('<Q', self.map, self.EPOCH_OFFSET)[0]
+
+    def generation(self, name):
+        return struct.unpack_from('<Q', self.map, self.OFFSETS[name])[0]
+
+    def bump(self, name):
+        generation = self.generation(name) + 1
+        struct.pack_into('<Q', self.map, self.OFFSETS[name], generation)
+        return generation
+
+    @contextmanager
+    def exclusive(self):
+        """Exclusive save lock; re-entrant within the process"""
+        if self._depth == 0:
+            fcntl.flock(self._lock_fd(None), fcntl.LOCK_EX)
+        self._depth += 1
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if self._depth == 0:
+                fcntl.flock(self._lock_fd(None), fcntl.LOCK_UN)
+
+    @contextmanager
+    def loading(self):
+        """Shared save lock so a reload never sees a save half done"""
+        if self._depth:
+            # Already exclusive; re-locking as shared would downgrade it
+            yield
+            return
+        fcntl.flock(self._lock_fd(None), fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd(None), fcntl.LOCK_UN)
+
+    @contextmanager
+    def form_locks(self, form_names):
+        """Exclusive cross-process locks on the slots of the given forms"""
+        slots = sorted({zlib.crc32(name.encode('utf-8')) % self.FORM_SLOTS for name in form_names})
+        with ExitStack() as stack:
+            for slot in slots:
+                stack.enter_context(self._slot_locks[slot])
+                fd = self._lock_fd(slot)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                stack.callback(fcntl.flock, fd, fcntl.LOCK_UN)
+            yield
+
+
+class DataStore:
+    """In-memory owner of the forms and orders documents.
+
+    Documents are loaded once from the storage backend (see storage.py) and
+    then served from memory. A read only reloads a document when the
+    backend's signature for it changed (for example when a file was edited
+    by hand), and every write or reload bumps ``version``.
+
+    The documents returned by ``forms()`` and ``orders()`` are shared, so a
+    caller that modifies forms must persist them with ``write_forms()``.
+    Orders are changed through ``commit_orders()`` with one mutation record,
+    which the backend can persist without rewriting everything.
+
+    ``lock`` only guards the short in-memory update and save. Handlers that
+    read, validate and then commit (e.g. reserving inventory) wrap that
+    sequence in ``transaction(form_name, ...)``, which holds one lock per
+    form, so orders for different bake days proceed in parallel.
+
+    With a SharedState (multi-process mode) freshness is decided by the
+    shared generation counters instead of file signatures, and saves and
+    transactions also take the matching cross-process locks.
+
+    ``data_version()`` turns the per-document change counters into a token
+    for ETags; in multi-process mode all workers produce the same token.
+    Every mutation is also recorded in ``changes`` (a ChangeFeed) for
+    incremental sync.
+
+    Forms are always handed out materialized (see catalog.py); with
+    ``normalize`` they are stored as catalog references plus overrides.
+    Resolution happens once per forms version, on load or write.
+    """
+
+    def __init__(self, storage, shared=None, changes=None, normalize=False):
+        self.storage = storage
+        self.shared = shared
+        self.normalize = normalize
+        self.changes = changes if changes is not None else ChangeFeed()
+        # Called with each change entry after it was persisted (under lock)
+        self.listeners = []
+        self.version = 0
+        self.epoch = format(shared.epoch(), 'x') if shared is not None else secrets.token_hex(4)
+        self.lock = threading.RLock()
+        self._docs = {}
+        self._signatures = {}
+        self._versions = {}
+        self._modified = {}
+        self.order_index = OrderIndex()
+        self.stock_counters = StockCounters()
+        # form name -> production plan, dropped per form on order commits
+        self._plans = {}
+        # form name -> [RLock, holders and waiters]; dropped when unused
+        self._form_locks = {}
+        self._form_locks_guard = threading.Lock()
+        self._last_order_stamp = 0.0
+
+    def _remember(self, name, data, generation=None):
+        self._docs[name] = data
+        if self.shared is not None:
+            self._signatures[name] = generation
+        else:
+            self._signatures[name] = self.storage.signature(name)
+        self.version += 1
+        self._versions[name] = self.version
+        self._modified[name] = time.time()
+        self.stock_counters.valid = False
+        self._plans = {}
+
+    def _forget(self, name):
+        self._docs.pop(name, None)
+        self.stock_counters.valid = False
+        self._plans = {}
+
+    def _saved(self, name, data):
+        """Record a document this process just persisted"""
+        generation = self.shared.bump(name) if self.shared is not None else None
+        self._remember(name, data, generation)
+
+    def _is_fresh(self, name):
+        if name not in self._docs:
+            return False
+        if self.shared is not None:
+            return self._signatures[name] == self.shared.generation(name)
+        return self._signatures[name] == self.storage.signature(name)
+
+    def _exclusive(self):
+        return self.shared.exclusive() if self.shared is not None else nullcontext()
+
+    def _get(self, name, load):
+        with self.lock:
+            if self._is_fresh(name):
+                return self._docs[name]
+            generation = None
+            if self.shared is not None:
+                with self.shared.loading():
+                    generation = self.shared.generation(name)
+                    data = load()
+            else:
+                data = load()
+            if name == 'orders':
+                self.order_index.rebuild(data)
+            RELOADS.inc(1, name)
+            self._remember(name, data, generation)
+            return data
+
+    @contextmanager
+    def _form_lock(self, form_name):
+        """Hold a form's thread lock; it only exists while someone uses it,
+        so names that are not (or no longer) forms do not pile up"""
+        with self._form_locks_guard:
+            entry = self._form_locks.setdefault(form_name, [threading.RLock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._form_locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._form_locks[form_name]
+
+    @contextmanager
+    def transaction(self, *form_names):
+        """Hold the locks of the given forms for a read-check-commit sequence"""
+        # Always acquire in sorted order so two-form moves cannot deadlock
+        names = sorted(set(form_names))
+        with ExitStack() as stack:
+            for name in names:
+                stack.enter_context(self._form_lock(name))
+            if self.shared is not None:
+                stack.enter_context(self.shared.form_locks(names))
+            yield
+
+    def data_version(self, *names):
+        """Return (token, last modified time) for the named documents.
+
+        The token changes whenever one of them changes; checking it costs a
+        freshness check, not a parse, unless the data really changed.
+        """
+        names = names or ('forms', 'orders')
+        with self.lock:
+            for name in names:
+                getattr(self, name)()
+            if self.shared is not None:
+                parts = [str(self._signatures[name]) for name in names]
+            else:
+                parts = [str(self._versions[name]) for name in names]
+            return '-'.join([self.epoch] + parts), max(self._modified[name] for name in names)
+
+    def forms(self):
+        """Return the forms document, reloading it only if storage changed"""
+        return self._get('forms', lambda: materialize_forms(self.storage.load_forms()))
+
+    def orders(self):
+        """Return the orders document, reloading it only if storage changed"""
+        return self._get('orders', self.storage.load_orders)
+
+    @contextmanager
+    def editing_forms(self):
+        """Yield a private copy of the forms document for a read-modify-write.
+
+        The store lock (and in multi-process mode the exclusive lock, with a
+        reload if another worker saved first) is held until the block ends,
+        so pass the copy to write_forms() inside it. Readers keep the current
+        document, which is only replaced once the copy was saved; leaving
+        the block without saving discards the changes.
+        """
+        with self.lock, self._exclusive():
+            yield copy.deepcopy(self.forms())
+
+    def write_forms(self, forms_data):
+        with self.lock, self._exclusive():
+            if self.normalize:
+                normalized = normalize_forms(forms_data)
+                self.storage.save_forms(normalized)
+                # Re-resolve so catalog edits reach every form right away
+                forms_data = materialize_forms(normalized)
+            else:
+                self.storage.save_forms(forms_data)
+            self._saved('forms', forms_data)
+            self._changed({"type": "forms_changed"})
+
+    def commit_orders(self, op):
+        """Apply one order mutation (or a batch of them) in memory and persist it"""
+        with self.lock, self._exclusive():
+            # Reloads first if another worker committed since our last read
+            orders = self.orders()
+            ops = op["ops"] if op["op"] == "batch" else [op]
+            for sub_op in ops:
+                if sub_op["op"] == "create" and self.order_index.lookup(sub_op["order"]["id"])[0] is not None:
+                    # Another worker took this timestamp id first
+                    sub_op["order"]["id"] = self.new_order_id()
+            counted = self.stock_counters.valid
+            plans = self._plans
+            try:
+                apply_order_op(orders, op, self.order_index)
+                self.storage.save_order_op(orders, op)
+            except BaseException:
+                # The shared document may hold the unsaved op: drop it so the
+                # next read reloads what storage really has
+                self._forget('orders')
+                raise
+            self._saved('orders', orders)
+            for sub_op in ops:
+                self._changed(order_change(orders, sub_op))
+            touched = op_forms(op)
+            if counted:
+                # Only the forms this op touched need new counters
+                for form_name in touched:
+                    self.stock_counters.refresh(orders, form_name)
+                self.stock_counters.valid = True
+            for form_name in touched:
+                plans.pop(form_name, None)
+            self._plans = plans
+
+    def _changed(self, change):
+        self.changes.record(change)
+        for listener in self.listeners:
+            listener(change)
+
+    def _counters(self):
+        forms_data, orders = self.forms(), self.orders()
+        if not self.stock_counters.valid:
+            self.stock_counters.rebuild(forms_data, orders)
+        return self.stock_counters
+
+    def stock(self, form_name):
+        """Inventory, ordered, remaining and soldOut per product of a form (None if unknown)"""
+        with self.lock:
+            return self._counters().stock(form_name)
+
+    def forms_stock(self, form_names=None):
+        """(forms document, {form name: stock}) taken from one version of both.
+
+        Reading forms and then stock() separately can pair a form with
+        counters built before it existed (or after it was removed).
+        """
+        with self.lock:
+            counters = self._counters()
+            # The document the counters were just checked against
+            forms_data = self._docs['forms']
+            names = forms_data if form_names is None else form_names
+            return forms_data, {name: counters.stock(name) for name in names}
+
+    def ordered(self, form_name):
+        """Ordered units per product name for a form"""
+        with self.lock:
+            return self._counters().ordered(form_name)
+
+    def production_plan(self, form_name):
+        """Ingredient totals for a form's orders (None if unknown), cached per form"""
+        with self.lock:
+            forms_data, orders = self.forms(), self.orders()
+            if form_name not in orders:
+                return None
+            if form_name not in self._plans:
+                self._plans[form_name] = production_plan(forms_data, form_name, orders[form_name])
+            return self._plans[form_name]
+
+    def new_order_id(self):
+        """Timestamp-based order id that stays unique for concurrent orders"""
+        with self.lock:
+            self.orders()
+            stamp = max(datetime.now().timestamp(), self._last_order_stamp + 0.000001)
+            while self.order_index.lookup(str(stamp))[0] is not None:
+                stamp += 0.000001
+            self._last_order_stamp = stamp
+            return str(stamp)
+
+    def find_order(self, order_id):
+        """Return (form name, position, order) for an id, or (None, None, None)"""
+        with self.lock:
+            orders = self.orders()
+            form_name, idx = self.order_index.lookup(order_id)
+            if form_name is None:
+                return None, None, None
+            return form_name, idx, orders[form_name]["orders"][idx]
+
+    def iter_orders(self, start=(0, 0)):
+        """Yield (form position, form name, order position, order) in document order.
+
+        Starts at ``start`` = (form position, order position). Each form's
+        order list is copied (references only) under the lock when the
+        iteration reaches it, so callers can stream results without holding
+        the lock across concurrent mutations.
+        """
+        form_pos, pos = start
+        while True:
+            with self.lock:
+                orders = self.orders()
+                names = list(orders)
+                if form_pos >= len(names):
+                    return
+                form_name = names[form_pos]
+                form_orders = list(orders[form_name]["orders"])
+            for i in range(pos, len(form_orders)):
+                yield form_pos, form_name, i, form_orders[i]
+            form_pos += 1
+            pos = 0
+
+    def changes_since(self, seq):
+        """(latest sequence number, serialized changes after seq or None on a gap)"""
+        with self.lock, (self.shared.loading() if self.shared is not None else nullcontext()):
+            changes = self.changes.since(seq)
+            return self.changes.seq, changes
+
+    def rebuild_aggregates(self):
+        """Recompute every form's aggregates from its orders and save them"""
+        with self.lock, self._exclusive():
+            orders = self.orders()
+            for form_name in orders:
+                recalc_aggregates(orders, form_name)
+            self.storage.save_orders(orders)
+            self._saved('orders', orders)
+            self._changed({"type": "orders_rebuilt"})
+            return orders
+
+    def compact(self):
+        """Ask the backend to fold pending order records into its snapshot"""
+        with self.lock, self._exclusive():
+            orders = self.orders()
+            self.storage.compact(orders)
+            self._saved('orders', orders)
@@ -0,0 +1,58 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+FORMS = [f"F{i}" for i in range(12)]
+WORKERS = 3
+THREADS = 8
+ORDERS_PER_WORKER = 40
+
+
+def _worker(data_dir, results):
+    """One gunicorn-like worker: MULTI_PROCESS with several request threads"""
+    os.chdir(data_dir)
+    os.environ['MULTI_PROCESS'] = '1'
+    import index
+
+    def create(i):
+        response = index.app.test_client().post('/api/orders', json={
+            "name": "x", "phone": "1", "date": FORMS[(i * 7 + os.getpid()) % len(FORMS)],
+            "selectedProducts": {"Rye": {"selected": True, "extras": {"s": 1}}}})
+        return response.status_code
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        results.put(list(pool.map(create, range(ORDERS_PER_WORKER))))
+
+
+def _seed(data_dir):
+    os.chdir(data_dir)
+    os.environ['MULTI_PROCESS'] = '1'
+    import index
+    client = index.app.test_client()
+    client.post('/api/forms/generic_products/products',
+                json={"product": {"name": "Rye", "inventory": 1000, "extras": []}})
+    for form_name in FORMS:
+        client.post('/api/forms', json={"formName": form_name})
+
+
+def test_threaded_workers_commit_orders_concurrently(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    seed = context.Process(target=_seed, args=(str(tmp_path),))
+    seed.start()
+    seed.join()
+    assert seed.exitcode == 0
+
+    results = context.Queue()
+    workers = [context.Process(target=_worker, args=(str(tmp_path), results)) for _ in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    codes = [code for _ in workers for code in results.get(timeout=120)]
+    for worker in workers:
+        worker.join()
+
+    assert codes == [200] * (WORKERS * ORDERS_PER_WORKER)
+    with open(tmp_path / 'orders.json') as f:
+        orders = json.load(f)
+    assert sum(len(orders[name]["orders"]) for name in FORMS) == WORKERS * ORDERS_PER_WORKER
+    assert sum(orders[name]["products"]["Rye"]["total_amount"] for name in FORMS) == WORKERS * ORDERS_PER_WORKER
@@ -0,0 +1,120 @@
+import json
+import os
+
+import pytest
+
+from storage import JsonStorage, ShardedJsonStorage, SqliteStorage
+from store import DataStore
+
+FORMS = {
+    "generic_products": {"products": [{"name": "Rye", "inventory": 10, "extras": [{"name": "sliced"}]}]},
+    "A": {"products": [{"name": "Rye", "inventory": 10, "extras": [{"name": "sliced"}]}]},
+    "B": {"products": [{"name": "Rye", "inventory": 10, "extras": [{"name": "sliced"}]}]},
+}
+
+
+def order(order_id, form_name, units=1):
+    return {"id": order_id, "name": f"customer {order_id}", "phone": "050", "date": form_name, "comment": "",
+            "selectedProducts": {"Rye": {"extras": {"sliced": units}}}, "totalAmount": 10 * units,
+            "timestamp": "2024-06-14T08:00:00"}
+
+
+def create(order_id, form_name, units=1):
+    return {"op": "create", "form": form_name, "order": order(order_id, form_name, units)}
+
+
+def commit_sample_ops(store):
+    """Every kind of order op, the way the routes commit them"""
+    store.write_forms(json.loads(json.dumps(FORMS)))
+    for form_name in ("A", "B"):
+        store.commit_orders({"op": "add_form", "form": form_name})
+    for i in range(1, 5):
+        store.commit_orders(create(str(i), "A", i))
+    store.commit_orders({"op": "update", "form": "A", "id": "2", "order": order("2", "A", 3)})
+    store.commit_orders({"op": "move", "form": "A", "target": "B", "id": "3", "order": order("3", "B", 3)})
+    store.commit_orders({"op": "delete", "form": "A", "id": "4"})
+    store.commit_orders({"op": "batch", "ops": [create("5", "B"), {"op": "delete", "form": "A", "id": "1"},
+                                                create("6", "A", 2)]})
+    store.commit_orders({"op": "add_form", "form": "C"})
+    store.commit_orders(create("7", "C"))
+    store.commit_orders({"op": "drop_form", "form": "C"})
+
+
+def json_storage(tmp_path, journal=False, compact_every=500):
+    if not os.path.exists(tmp_path / 'orders.json'):
+        (tmp_path / 'orders.json').write_text('{}')
+    return JsonStorage(str(tmp_path / 'forms.json'), str(tmp_path / 'orders.json'), FORMS,
+                       journal=journal, compact_every=compact_every)
+
+
+BACKENDS = {
+    'json': json_storage,
+    'journal': lambda tmp_path: json_storage(tmp_path, journal=True),
+    'journal-compacting': lambda tmp_path: json_storage(tmp_path, journal=True, compact_every=3),
+    'sharded': lambda tmp_path: ShardedJsonStorage(str(tmp_path / 'forms.json'), str(tmp_path / 'orders'), FORMS),
+    'sqlite': lambda tmp_path: SqliteStorage(str(tmp_path / 'bakery.db'), FORMS),
+}
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_reload_equals_memory(tmp_path, backend):
+    store = DataStore(BACKENDS[backend](tmp_path))
+    commit_sample_ops(store)
+
+    reloaded = DataStore(BACKENDS[backend](tmp_path))
+    assert reloaded.orders() == store.orders()
+    assert list(reloaded.orders()) == list(store.orders()) == ["A", "B"]
+    assert reloaded.forms() == store.forms()
+    assert [o["id"] for o in reloaded.orders()["A"]["orders"]] == ["2", "6"]
+    assert [o["id"] for o in reloaded.orders()["B"]["orders"]] == ["3", "5"]
+    assert reloaded.stock("A")["Rye"]["ordered"] == 5
+
+
+def test_torn_journal_tail_is_cut_before_the_next_append(tmp_path):
+    store = DataStore(json_storage(tmp_path, journal=True))
+    store.write_forms(json.loads(json.dumps(FORMS)))
+    store.commit_orders({"op": "add_form", "form": "A"})
+    store.commit_orders(create("1", "A"))
+    # A crash in the middle of appending the next record
+    with open(tmp_path / 'orders.json.journal', 'ab') as f:
+        f.write(b'{"op":"create","form":"A","ord')
+
+    restarted = DataStore(json_storage(tmp_path, journal=True))
+    assert [o["id"] for o in restarted.orders()["A"]["orders"]] == ["1"]
+    restarted.commit_orders(create("2", "A"))
+    restarted.commit_orders(create("3", "A"))
+
+    reloaded = DataStore(json_storage(tmp_path, journal=True))
+    assert [o["id"] for o in reloaded.orders()["A"]["orders"]] == ["1", "2", "3"]
+    assert reloaded.orders() == restarted.orders()
+
+
+def test_replay_after_crash_during_compaction_is_idempotent(tmp_path):
+    storage = json_storage(tmp_path, journal=True)
+    store = DataStore(storage)
+    commit_sample_ops(store)
+    expected = store.orders()
+    # compact() wrote the snapshot but crashed before removing the journal
+    journal = (tmp_path / 'orders.json.journal').read_bytes()
+    storage.compact(expected)
+    (tmp_path / 'orders.json.journal').write_bytes(journal)
+
+    reloaded = DataStore(json_storage(tmp_path, journal=True))
+    assert reloaded.orders() == expected
+
+
+def test_failed_save_leaves_no_order_in_memory(tmp_path):
+    storage = json_storage(tmp_path, journal=True)
+    store = DataStore(storage)
+    commit_sample_ops(store)
+    before = json.loads(json.dumps(store.orders()))
+
+    def full_disk(op):
+        raise OSError("No space left on device")
+    storage._append_journal = full_disk
+    with pytest.raises(OSError):
+        store.commit_orders(create("8", "A", 5))
+    del storage._append_journal
+
+    assert store.orders() == before
+    assert store.stock("A")["Rye"]["ordered"] == 5
@@ -4,7 +4,7 @@ import LeftPanel from './components/LeftPanel'
 import Form from './components/Form';
 import Home from './components/Home';
 import EditOrder from './components/EditOrder';
-import { getDates, getProducts } from './services/api';
+import { getDates, getProducts, subscribeToStock } from './services/api';
 
 interface Extra {
   name: string;
@@ -19,6 +19,7 @@ interface ProductData {
   extras: Extra[];
   soldOut: boolean;
   inventory: number;
+  imageVersion?: string | null;
 }
 
 function App() {
@@ -96,6 +97,17 @@ function App() {
     fetchProductsForPage();
   }, [selectedForm, pages]);
 
+  // Keep soldOut flags live while a form is open
+  useEffect(() => {
+    if (selectedForm === "Home" || !pages.includes(selectedForm)) return;
+
+    return subscribeToStock(selectedForm, (stock) => {
+      setProducts(current => current.map(product =>
+        stock[product.name] ? { ...product, soldOut: stock[product.name].soldOut } : product
+      ));
+    });
+  }, [selectedForm, pages]);
+
   const onPlaceAnotherOrder = async () => {
     if (selectedForm !== "Home") {
       try {
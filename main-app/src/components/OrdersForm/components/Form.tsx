@@ -23,6 +23,7 @@ interface ProductData {
   extras: Extra[];
   soldOut: boolean;
   inventory: number;
+  imageVersion?: string | null;
 }
 
 interface Order {
@@ -600,6 +601,7 @@ function Form({
                     isSelected={selectedProducts[product.name]?.selected || false}
                     selectedExtras={selectedProducts[product.name]?.extras || {}}
                     inventoryError={inventoryErrors[product.name]} // Pass inventory error
+                    imageVersion={product.imageVersion}
                 />
               ))}
             </div>
@@ -5,6 +5,7 @@ import { getProducts } from '../services/api';
 interface Product {
   name: string;
   image: string;
+  imageVersion?: string | null;
 }
 
 interface HomeProps {
@@ -231,7 +232,7 @@ const Home = ({ pages = [], onSelectForm, panelOpen }: HomeProps) => {
           {products.map((product, index) => (
             <div key={index} className="product-card">
               <img 
-                src={`http://13.49.120.33/api/images/${encodeURIComponent(product.name)}`} 
+                src={`http://13.49.120.33/api/images/${encodeURIComponent(product.name)}?size=card&format=webp${product.imageVersion ? `&v=${product.imageVersion}` : ''}`} 
                 alt={product.name} 
                 className="product-image"
                 onError={(e) => {
@@ -17,6 +17,7 @@ interface ProductProps {
   isSelected: boolean;
   selectedExtras: {[key: string]: number};
   inventoryError?: string;
+  imageVersion?: string | null;
 }
 
 function Product({ 
@@ -28,7 +29,8 @@ function Product({
   onExtraChange, 
   isSelected, 
   selectedExtras,
-  inventoryError
+  inventoryError,
+  imageVersion
 }: ProductProps) {
   
   const [isMobile, setIsMobile] = useState(window.innerWidth < 768);
@@ -43,7 +45,9 @@ function Product({
     }, []);
     
   const getImageSrc = () => {
-    return `http://13.49.120.33/api/images/${encodeURIComponent(name)}`;
+    // With the content hash in the URL the image is cached as immutable
+    const version = imageVersion ? `&v=${imageVersion}` : '';
+    return `http://13.49.120.33/api/images/${encodeURIComponent(name)}?size=thumb&format=webp${version}`;
   };
   
   const handleSelection = () => {
@@ -5,33 +5,15 @@ const API_URL = 'http://13.49.120.33/api';
 // Function to get available dates
 export const getDates = async () => {
   try {
-    const response = await fetch(`${API_URL}/dates`);
+    // One request: the server only returns dates that are visible
+    const response = await fetch(`${API_URL}/storefront`);
     const data = await response.json();
     
     if (!data.success) {
       throw new Error(data.error || 'Failed to fetch dates');
     }
     
-    // Filter out dates that are not visible
-    const visibleDates = await Promise.all(
-      data.dates.map(async (date: string) => {
-        try {
-          const metadataResponse = await fetch(`${API_URL}/products/${encodeURIComponent(date)}`);
-          const metadataData = await metadataResponse.json();
-          
-          if (metadataData.success && metadataData.metadata && metadataData.metadata.visible === false) {
-            return null; // Skip dates that are explicitly marked as not visible
-          }
-          return date;
-        } catch (error) {
-          console.error(`Error fetching metadata for date ${date}:`, error);
-          return date; // If there's an error, include the date by default
-        }
-      })
-    );
-    
-    // Remove null values (invisible dates)
-    return visibleDates.filter(date => date !== null);
+    return data.forms.map((form: { date: string }) => form.date);
   } catch (error) {
     console.error('Error fetching dates:', error);
     throw error;
@@ -58,34 +40,17 @@ export const getAllDates = async () => {
 // Function to get dates with visibility information - for admin purposes
 export const getDatesWithVisibility = async () => {
   try {
-    const response = await fetch(`${API_URL}/dates`);
+    const response = await fetch(`${API_URL}/storefront?all=1`);
     const data = await response.json();
     
     if (!data.success) {
       throw new Error(data.error || 'Failed to fetch dates');
     }
     
-    // Get visibility information for each date
-    const datesWithVisibility = await Promise.all(
-      data.dates.map(async (date: string) => {
-        try {
-          const metadataResponse = await fetch(`${API_URL}/products/${encodeURIComponent(date)}`);
-          const metadataData = await metadataResponse.json();
-          
-          return {
-            date,
-            visible: metadataData.success && metadataData.metadata ? 
-                    metadataData.metadata.visible !== false : 
-                    true // Default to visible if metadata is missing
-          };
-        } catch (error) {
-          console.error(`Error fetching metadata for date ${date}:`, error);
-          return { date, visible: true }; // Default to visible on error
-        }
-      })
-    );
-    
-    return datesWithVisibility;
+    return data.forms.map((form: { date: string; metadata?: { visible?: boolean } }) => ({
+      date: form.date,
+      visible: form.metadata ? form.metadata.visible !== false : true // Default to visible if metadata is missing
+    }));
   } catch (error) {
     console.error('Error fetching dates with visibility:', error);
     throw error;
@@ -121,6 +86,69 @@ export const getProducts = async (date: string) => {
   }
 };
 
+export type StockMap = { [productName: string]: { remaining: number; soldOut: boolean } };
+
+// Live remaining-stock updates for one form. Uses Server-Sent Events and falls
+// back to polling the stock endpoint where EventSource is unavailable, the
+// server refuses the stream (503 when streams are disabled or full) or the
+// stream keeps failing. Returns a function that stops the updates.
+export const subscribeToStock = (
+  date: string,
+  onStock: (stock: StockMap) => void,
+  pollIntervalMs = 15000
+) => {
+  const formPath = `${API_URL}/forms/${encodeURIComponent(date)}/stock`;
+  let pollTimer: ReturnType<typeof setInterval> | null = null;
+  let source: EventSource | null = null;
+  let failures = 0;
+
+  const poll = async () => {
+    try {
+      const response = await fetch(formPath);
+      const data = await response.json();
+      if (data.success) {
+        onStock(data.stock);
+      }
+    } catch (error) {
+      console.error(`Error polling stock for ${date}:`, error);
+    }
+  };
+
+  const startPolling = () => {
+    if (source) {
+      source.close();
+      source = null;
+    }
+    if (!pollTimer) {
+      poll();
+      pollTimer = setInterval(poll, pollIntervalMs);
+    }
+  };
+
+  if (typeof EventSource === 'undefined') {
+    startPolling();
+  } else {
+    source = new EventSource(`${formPath}/events`);
+    source.addEventListener('stock', (event) => {
+      failures = 0;
+      onStock(JSON.parse((event as MessageEvent).data).stock);
+    });
+    source.onerror = () => {
+      // EventSource reconnects by itself after a dropped stream, but closes
+      // for good on an error response; give up after repeated failures
+      failures += 1;
+      if (source?.readyState === EventSource.CLOSED || failures >= 3) {
+        startPolling();
+      }
+    };
+  }
+
+  return () => {
+    if (source) source.close();
+    if (pollTimer) clearInterval(pollTimer);
+  };
+};
+
 // Function to update form visibility
 export const updateFormVisibility = async (visibilityData: { [key: string]: boolean }) => {
   try {